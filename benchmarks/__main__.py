@@ -0,0 +1,35 @@
+import argparse
+import fnmatch
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import runner
+from benchmarks.scenarios import scenarios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark vortex in-process with synthetic requests')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='timed requests per scenario')
+    parser.add_argument('-k', '--filter', default='*', help='only run scenarios matching this glob')
+    parser.add_argument('--save', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', help='compare against a saved JSON baseline')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('vortex').addHandler(logging.NullHandler())
+    baseline = runner.load(args.compare) if args.compare else None
+    results = []
+    for scenario in scenarios():
+        if fnmatch.fnmatch(scenario.name, args.filter):
+            results.append((scenario.name, runner.run(scenario, args.requests)))
+            sys.stderr.write('.')
+    sys.stderr.write('\n')
+    print(runner.report(results, baseline))
+    if args.save:
+        runner.save(args.save, results)
+
+
+if __name__ == '__main__':
+    main()
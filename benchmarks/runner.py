@@ -0,0 +1,83 @@
+import gc
+import json
+import time
+
+from benchmarks.stub import StubRequest
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _request(scenario):
+    return StubRequest(scenario.uri, scenario.method, scenario.headers)
+
+
+def _run_once(scenario, request):
+    scenario.application(request)
+    request.connection.drain()
+
+
+def _retained(scenario, requests):
+    # GC-tracked objects each request leaves alive, reference cycles included since the collector is off meanwhile.
+    # Python 2 has no way to count allocations that are freed again, so this catches leaks and cycles, not churn.
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for i in range(requests):
+            _run_once(scenario, _request(scenario))
+        return float(len(gc.get_objects()) - before) / requests
+    finally:
+        gc.enable()
+
+
+def run(scenario, requests=2000, warmup=100):
+    request = _request(scenario)
+    _run_once(scenario, request)
+    if request.connection.status_code != 200 or not request.connection.finished:
+        raise AssertionError('%s: expected a finished 200 response, got %r' % (scenario.name, request.connection.status_code))
+    for i in range(warmup):
+        _run_once(scenario, _request(scenario))
+
+    latencies = []
+    started = clock()
+    for i in range(requests):
+        request = _request(scenario)
+        start = clock()
+        _run_once(scenario, request)
+        latencies.append(clock() - start)
+    elapsed = clock() - started
+    latencies.sort()
+    return {
+        'requests_per_second': requests / elapsed,
+        'p50_us': _percentile(latencies, 0.5) * 1e6,
+        'p99_us': _percentile(latencies, 0.99) * 1e6,
+        'retained_per_request': _retained(scenario, min(requests, 500)),
+        'bytes_per_response': request.connection.bytes_written,
+    }
+
+
+def report(results, baseline=None):
+    lines = ['%-32s %12s %10s %10s %12s' % ('scenario', 'req/s', 'p50 us', 'p99 us', 'retained/req')]
+    for name, result in results:
+        line = '%-32s %12.0f %10.1f %10.1f %12.1f' % (name, result['requests_per_second'], result['p50_us'], result['p99_us'], result['retained_per_request'])
+        if baseline is not None and name in baseline:
+            previous = baseline[name]
+            line += '   req/s %+6.1f%%  p99 %+6.1f%%' % (
+                100.0 * (result['requests_per_second'] / previous['requests_per_second'] - 1),
+                100.0 * (result['p99_us'] / previous['p99_us'] - 1) if previous['p99_us'] else 0.0)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save(path, results):
+    with open(path, 'w') as file:
+        json.dump(dict(results), file, indent=2, sort_keys=True)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+from vortex import Application, HTTPPreamble, HTTPStream, ResolutionCache, Resource
+from vortex.resources import DictResource, JSONResource, StaticFileCache, StaticFileResource
+
+GZIP = {'Accept-Encoding': 'gzip'}
+TEXT = 'The quick brown fox jumps over the lazy dog. ' * 64
+
+
+class ArgResource(Resource):
+    def get(self, request, a, b='default', c=None):
+        return 'a=%s, b=%s, c=%s' % (a, b, c)
+
+
+class ChunkedResource(Resource):
+    def get(self, request):
+        stream = HTTPStream(request, HTTPPreamble(headers={'Content-Type': 'text/plain'}))
+        for i in range(16):
+            stream.flush(TEXT[:1024])
+        stream.finish()
+
+
+def _deep_tree(depth):
+    leaf = DictResource({'leaf': lambda request: 'leaf'})
+    for i in range(depth):
+        leaf = DictResource({'level%d' % (depth - i - 1): leaf, 'sibling': DictResource()})
+    return leaf
+
+
+def _static_file(directory, size):
+    path = os.path.join(directory, 'file-%d.txt' % size)
+    with open(path, 'wb') as file:
+        file.write((TEXT * (size // len(TEXT) + 1))[:size])
+    return path
+
+
+class Scenario(object):
+    def __init__(self, name, application, uri, headers=None, method='GET'):
+        self.name = name
+        self.application = application
+        self.uri = uri
+        self.headers = headers
+        self.method = method
+
+
+def scenarios():
+    directory = tempfile.mkdtemp(prefix='vortex-bench-')
+    deep_path = '/' + '/'.join(['level%d' % i for i in range(10)]) + '/leaf'
+    static_cache = StaticFileCache()
+    files = dict([(size, _static_file(directory, size)) for size in (1024, 64*2**10, 2**20)])
+
+    yield Scenario('hello', Application({'': lambda request: 'Hello World!'}), '/')
+    yield Scenario('deep_dict', Application(_deep_tree(10)), deep_path)
+    yield Scenario('deep_dict_resolution_cache', Application(_deep_tree(10), resolution_cache=ResolutionCache()), deep_path)
+    yield Scenario('json', Application({'json': JSONResource({'a': ['b', 1], 'c': {'d': True, 'e': range(100)}})}), '/json/c')
+    yield Scenario('args', Application({'args': ArgResource()}), '/args?a=1&b=2&c=3')
+    yield Scenario('text_identity', Application({'': lambda request: TEXT}), '/')
+    yield Scenario('text_gzip', Application({'': lambda request: TEXT}), '/', GZIP)
+    yield Scenario('chunked_identity', Application({'': ChunkedResource()}), '/')
+    yield Scenario('chunked_gzip', Application({'': ChunkedResource()}), '/', GZIP)
+    for size, path in sorted(files.items()):
+        label = '%dk' % (size // 1024)
+        yield Scenario('static_%s_identity' % label, Application({'f': StaticFileResource(path)}), '/f')
+        yield Scenario('static_%s_gzip' % label, Application({'f': StaticFileResource(path)}), '/f', GZIP)
+        yield Scenario('static_%s_streaming' % label, Application({'f': StaticFileResource(path, streaming=True)}), '/f')
+        yield Scenario('static_%s_cached_gzip' % label, Application({'f': StaticFileResource(path, cache=static_cache)}), '/f', GZIP)
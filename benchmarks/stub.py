@@ -0,0 +1,52 @@
+from Cookie import SimpleCookie
+import urlparse
+
+
+class StubConnection(object):
+    # Records writes instead of sending them; write callbacks are queued to mimic the IOLoop draining the socket
+    def __init__(self):
+        self.writes = []
+        self.bytes_written = 0
+        self.finished = False
+        self.callbacks = []
+
+    def write(self, data, callback=None):
+        self.writes.append(data)
+        self.bytes_written += len(data)
+        if callback is not None:
+            self.callbacks.append(callback)
+
+    def finish(self):
+        self.finished = True
+
+    def drain(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+    @property
+    def status_code(self):
+        return int(self.writes[0].split(' ', 2)[1]) if self.writes else None
+
+
+class StubRequest(object):
+    def __init__(self, uri, method='GET', headers=None, body=''):
+        self.method = method
+        self.uri = uri
+        self.path, _, self.query = uri.partition('?')
+        self.arguments = urlparse.parse_qs(self.query)
+        self.headers = dict(headers or {})
+        self.body = body
+        self.version = 'HTTP/1.1'
+        self.remote_ip = '127.0.0.1'
+        self.host = self.headers.get('Host', 'localhost')
+        self.connection = StubConnection()
+        self.cookies = SimpleCookie(self.headers.get('Cookie', ''))
+
+    def write(self, data, callback=None):
+        self.connection.write(data, callback)
+
+    def finish(self):
+        self.connection.finish()
+
+    def __str__(self):
+        return '%s %s' % (self.method, self.uri)
@@ -12,6 +12,9 @@ except ImportError:
 
 kwargs = {}
 
+if "setuptools" in sys.modules:
+    kwargs["entry_points"] = {"console_scripts": ["vortex = vortex.server:main"]}
+
 major, minor = sys.version_info[:2]
 
 if major >= 3:
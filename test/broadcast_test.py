@@ -0,0 +1,54 @@
+import socket
+import unittest
+from   tornado import gen
+from   tornado.httpserver import HTTPServer
+from   tornado.iostream import IOStream
+from   tornado.testing import AsyncTestCase, bind_unused_port, gen_test
+
+from   vortex import Application
+from   vortex.broadcast import BroadcastResource
+
+
+class BroadcastBackpressureTest(AsyncTestCase):
+    def setUp(self):
+        AsyncTestCase.setUp(self)
+        self.hub = BroadcastResource(heartbeat=0, max_pending=45)
+        sock, self.port = bind_unused_port()
+        self.server = HTTPServer(Application({'events': self.hub}), io_loop=self.io_loop)
+        self.server.add_sockets([sock])
+
+    def tearDown(self):
+        self.server.stop()
+        AsyncTestCase.tearDown(self)
+
+    @gen_test(timeout=10)
+    def test_burst_then_drain(self):
+        client = socket.socket()
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        stream = IOStream(client, io_loop=self.io_loop)
+        yield stream.connect(('127.0.0.1', self.port))
+        yield stream.write('GET /events HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n')
+        yield stream.read_until('\r\n\r\n')
+        while not self.hub.subscribers:
+            yield gen.moment
+        subscriber = list(self.hub.subscribers)[0]
+
+        # A slow reader: each burst backs up in the server's write buffer, then the client catches up. Before the
+        # backlog was measured from the stream, the second burst pushed the subscriber past max_pending.
+        for burst in range(2):
+            for i in range(30):
+                self.hub.publish('x' * 1048576)
+            self.assertIn(subscriber, self.hub.subscribers)
+            self.assertGreater(subscriber.pending, 1)
+            received = 0
+            while received < 30:
+                chunk = yield stream.read_bytes(1048576, partial=True)
+                received += chunk.count('data: ')
+            self.hub.publish('caught up')
+            self.assertEqual(subscriber.pending, 1)
+            yield stream.read_until('caught up')
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
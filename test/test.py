@@ -8,7 +8,8 @@ from   tornado.ioloop import IOLoop
 from   tornado.template import Loader
 import uuid
 
-from   vortex import Application, HTTPResponse, HTTPStream, Resource, authenticate, signed_cookie, xsrf
+from   tornado import gen
+from   vortex import Application, HTTPPreamble, HTTPResponse, HTTPStream, Resource, authenticate, signed_cookie, xsrf
 from   vortex.resources import DictResource, JSONResource, StaticDirectoryResource, StaticFileResource, UploadResource
 
 class ArgResource(Resource):
@@ -57,10 +58,15 @@ class AsyncResource(Resource):
         def callback():
             response.write('This was asynchronous')
             response.finish()
-        response = HTTPStream(HTTPResponse())
+        response = HTTPStream(request, HTTPPreamble())
         IOLoop.instance().add_timeout(timedelta(seconds=2), callback)
         return response
 
+class CoroutineResource(Resource):
+    def get(self, request):
+        yield gen.sleep(2)
+        raise gen.Return('This was a coroutine')
+
 
 logging.getLogger('vortex').addHandler(logging.StreamHandler())
 
@@ -79,6 +85,7 @@ app = Application({
         'logout': LogoutResource(),
     },
     'async': AsyncResource(),
+    'coroutine': CoroutineResource(),
     'upload': UploadFormResource(loader),
 })
 HTTPServer(app).listen(port=3000)
@@ -1,13 +1,5 @@
-try:
-    import BytesIO
-except ImportError:
-    try:
-        from cStringIO import StringIO as BytesIO
-    except ImportError:
-        from StringIO import StringIO as BytesIO
-from   Cookie import SimpleCookie
+from   Cookie import Morsel, SimpleCookie
 from   email.utils import formatdate
-from   gzip import GzipFile
 import hashlib
 import httplib
 import inspect
@@ -17,29 +9,62 @@ try:
     import cStringIO as StringIO
 except ImportError:
     import StringIO
+import time
+import sys
+from   tornado.concurrent import Future, is_future
 from   tornado.escape import utf8
+import tornado.gen
+from   tornado.ioloop import IOLoop
 import tornado.web
 import traceback
+from   types import GeneratorType
 import urllib
+from   weakref import WeakSet
 from   xml.etree.ElementTree import Element, ElementTree, iselement
+import zlib
+
+from   vortex.cache import LRUCache
 
 logger = logging.getLogger('vortex')
 
 SAFE_METHODS = set(('GET', 'HEAD'))
 
 
-def authenticate(retrieve, cookie_name, redirect=None, unauthorized=None):
+def authenticate(retrieve, cookie_name, redirect=None, unauthorized=None, cache=None):
+    # cache is an optional LRUCache of cookie value -> user, whose ttl bounds how long a revoked session is still
+    # let in. Call logout(request) or invalidate(cookie_value) on the decorator, or on a method it wraps, to forget
+    # a session at once.
+    if cache is not None and cache.ttl is None:
+        raise ValueError('The authenticated user cache needs a ttl')
+
+    def invalidate(cookie_value):
+        if cache is not None:
+            cache.pop(cookie_value)
+
+    def logout(request):
+        cookie = request.cookies.get(cookie_name, None)
+        if cookie is not None:
+            invalidate(cookie.value)
+
     def wrap1(fn):
         def wrap2(self, request, *args, **kwargs):
             cookie = request.cookies.get(cookie_name, None)
             if cookie is not None:
-                user = retrieve(self, cookie)
+                user = cache.get(cookie.value) if cache is not None else None
+                if user is None:
+                    user = retrieve(self, cookie)
+                    if user is not None and cache is not None:
+                        cache.set(cookie.value, user)
                 if user is not None:
                     return fn(self, request, user, *args, **kwargs)
             if redirect and request.method in SAFE_METHODS:
                 return HTTPResponse(HTTPPreamble(httplib.FOUND, headers={'Location': redirect}))
             return unauthorized(request) if unauthorized else HTTPResponse(HTTPPreamble(httplib.UNAUTHORIZED))
+        wrap2.invalidate = invalidate
+        wrap2.logout = logout
         return wrap2
+    wrap1.invalidate = invalidate
+    wrap1.logout = logout
     return wrap1
 
 
@@ -57,34 +82,219 @@ def xsrf_form_html(cookie):
     return r'''<script language="javascript">var r=document.cookie.match('\\b%s=([^;]*)\\b');document.write("<input type=\"hidden\" name=\"_xsrf\" value=\""+(r?r[1]:'')+"\" />");</script>''' % cookie
 
 
-def signed_cookie(secret):
+class SignedCookies(object):
+    # Verifies each signed cookie the first time it's read, so cookies the handler never looks at cost nothing
+    def __init__(self, secret, cookies, cache=None, max_age_days=31):
+        self._secret = secret
+        self._cookies = cookies
+        self._cache = cache
+        self._max_age_days = max_age_days
+        self._verified = {}
+
+    def _verify(self, name):
+        if name in self._verified:
+            return self._verified[name]
+        cookie = self._cookies.get(name, None)
+        morsel = None
+        if cookie is not None:
+            key = (self._secret, name, cookie.value)
+            value = self._cache.get(key) if self._cache is not None else None
+            if value is None:
+                value = tornado.web.decode_signed_value(self._secret, name, cookie.value, self._max_age_days)
+                if value is not None and self._cache is not None:
+                    self._cache.set(key, value)
+            if value is not None:
+                morsel = Morsel()
+                morsel.set(name, value, value)
+        self._verified[name] = morsel
+        return morsel
+
+    def __getitem__(self, name):
+        morsel = self._verify(name)
+        if morsel is None:
+            raise KeyError(name)
+        return morsel
+
+    def get(self, name, default=None):
+        morsel = self._verify(name)
+        return morsel if morsel is not None else default
+
+    def __contains__(self, name):
+        return self._verify(name) is not None
+
+    def __delitem__(self, name):
+        self._verify(name)
+        del self._cookies[name]
+        del self._verified[name]
+
+    def keys(self):
+        return [name for name in self._cookies.keys() if self._verify(name) is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(name, self._verified[name]) for name in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def values(self):
+        return [morsel for name, morsel in self.items()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+
+def _then(response, fn):
+    # Applies fn to a handler's result, either now or once its future or coroutine resolves
+    if isinstance(response, GeneratorType):
+        response = tornado.gen.coroutine(lambda: response)()
+    if not is_future(response):
+        return fn(response)
+    result = Future()
+    def resolved(future):
+        try:
+            result.set_result(fn(future.result()))
+        except:
+            result.set_exc_info(sys.exc_info())
+    IOLoop.current().add_future(response, resolved)
+    return result
+
+
+def signed_cookie(secret, cache=None, max_age_days=31):
+    # cache is an optional LRUCache shared between requests, holding the values of signatures already verified.
+    # Cached values skip the signature's age check, so its ttl bounds how long past max_age_days one stays valid.
+    if cache is not None and (cache.ttl is None or cache.ttl > max_age_days * 86400):
+        raise ValueError('The signed cookie cache needs a ttl no longer than max_age_days')
     def wrap1(fn):
-        def wrap2(self, request, *args, **kwargs):
-            for key, cookie in request.cookies.items():
-                value = tornado.web.decode_signed_value(secret, cookie.key, cookie.value)
-                if value is None:
-                    del request.cookies[key]
-                else:
+        def sign(response):
+            preamble = getattr(response, 'preamble', None)
+            if preamble is not None and preamble._cookies:
+                for key, cookie in preamble._cookies.iteritems():
+                    value = tornado.web.create_signed_value(secret, key, unicode(cookie.value))
                     cookie.set(key, value, value)
-            response = fn(self, request, *args, **kwargs)
-            for key, cookie in getattr(response, 'cookies', {}).iteritems():
-                value = tornado.web.create_signed_value(secret, key, unicode(cookie.value))
-                cookie.set(key, value, value)
-                cookie['path'] = '/'
+                    cookie['path'] = '/'
             return response
+
+        def wrap2(self, request, *args, **kwargs):
+            cookies = SignedCookies(secret, request.cookies, cache, max_age_days)
+            try:
+                request.cookies = cookies
+            except AttributeError: # tornado's cookies property has no setter, but caches the parsed jar here
+                request._cookies = cookies
+            return _then(fn(self, request, *args, **kwargs), sign)
+        return wrap2
+    return wrap1
+
+
+class ResponseCache(object):
+    def __init__(self, max_bytes=32*2**20, ttl=60): # 32MB, seconds
+        self.entries = LRUCache(max_bytes=max_bytes, ttl=ttl, sizeof=lambda entry: len(entry[2]))
+
+    def stats(self):
+        return self.entries.stats()
+
+    def invalidate(self, path=None):
+        if path is None:
+            self.entries.clear()
+        else:
+            for key in self.entries:
+                if key[0] == path:
+                    self.entries.pop(key)
+
+
+def _not_modified(request, etag):
+    inm = request.headers.get('If-None-Match', None)
+    return inm is not None and (inm.find(etag) != -1 or inm == '*')
+
+
+def cached(cache, ttl=None, vary=()):
+    # Caches successful GET responses by path, arguments and the values of the vary request headers, and answers
+    # If-None-Match from the cached ETag without calling the handler. HEAD is answered from the GET entry but never
+    # stored, since a head handler's empty body would then be served to GET.
+    def wrap1(fn):
+        def store(request, key, response):
+            response = coerce_response(response)
+            if not isinstance(response, HTTPResponse) or response.preamble.status_code != httplib.OK or \
+               not isinstance(response.body, basestring) or response.preamble._cookies:
+                return response
+            headers = response.preamble.headers
+            for header in vary:
+                append_header(headers, 'Vary', header)
+            cache_control = headers.get('Cache-Control', '')
+            if 'no-store' in cache_control or 'private' in cache_control or 'Set-Cookie' in headers:
+                return response
+            body = utf8(response.body)
+            etag = headers.setdefault('Etag', '"%s"' % hashlib.sha1(body).hexdigest())
+            cache.entries.set(key, (dict(headers), etag, body), ttl=ttl)
+            if _not_modified(request, etag):
+                return HTTPResponse(HTTPPreamble(httplib.NOT_MODIFIED, headers={'Etag': etag}))
+            return response
+
+        def wrap2(self, request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return fn(self, request, *args, **kwargs)
+            key = (request.path, tuple(sorted([(name, tuple(values)) for name, values in request.arguments.iteritems()])),
+                   tuple([request.headers.get(header, None) for header in vary]), args)
+            try:
+                entry = cache.entries.get(key)
+            except TypeError: # unhashable positional arguments
+                return fn(self, request, *args, **kwargs)
+            if entry is not None:
+                headers, etag, body = entry
+                if _not_modified(request, etag):
+                    return HTTPResponse(HTTPPreamble(httplib.NOT_MODIFIED, headers={'Etag': etag}))
+                if request.method == 'HEAD':
+                    headers = dict(headers)
+                    headers['Content-Length'] = str(len(body))
+                    return HTTPResponse(HTTPPreamble(headers=headers))
+                return HTTPResponse(HTTPPreamble(headers=dict(headers)), body=body)
+
+            if request.method != 'GET':
+                return fn(self, request, *args, **kwargs)
+            return _then(fn(self, request, *args, **kwargs), lambda response: store(request, key, response))
+        wrap2.__wrapped__ = fn
         return wrap2
     return wrap1
 
 
+_json_serializer = json.dumps
+
+
+def set_json_serializer(serializer):
+    # Swap in a faster encoder; it must take a JSON-compatible value and return a byte string
+    global _json_serializer
+    _json_serializer = serializer or json.dumps
+
+
+def json_dumps(value):
+    return _json_serializer(value)
+
+
+def _typed_preamble(content_type):
+    preamble = HTTPPreamble()
+    preamble.headers['Content-Type'] = content_type
+    return preamble
+
+
 def coerce_response(response):
     if isinstance(response, basestring):
-        response = HTTPResponse(HTTPPreamble(headers={'Content-Type': 'text/html'}), body=response)
+        response = HTTPResponse(_typed_preamble('text/html'), body=response)
     elif isinstance(response, dict):
-        response = HTTPResponse(HTTPPreamble(headers={'Content-Type': 'application/json'}), body=json.dumps(response))
+        response = HTTPResponse(_typed_preamble('application/json'), body=json_dumps(response))
+    elif isinstance(response, list):
+        if len(response) > JSONStream.threshold:
+            response = JSONStream(response)
+        else:
+            response = HTTPResponse(_typed_preamble('application/json'), body=json_dumps(response))
     elif iselement(response):
-        xml = StringIO()
+        xml = StringIO.StringIO()
         ElementTree(response).write(xml)
-        response = HTTPResponse(HTTPPreamble(headers={'Content-Type': 'application/xml'}), body=xml.getvalue())
+        response = HTTPResponse(_typed_preamble('application/xml'), body=xml.getvalue())
     return response
 
 
@@ -92,66 +302,274 @@ def http_date(timeval):
     return formatdate(timeval=timeval, localtime=False, usegmt=True)
 
 
+_date = (None, None)
+
+
+def current_http_date():
+    # The Date header has a resolution of one second, so it only needs formatting once per second
+    global _date
+    now = int(time.time())
+    date = _date
+    if date[0] != now:
+        date = _date = (now, http_date(now))
+    return date[1]
+
+
+def append_header(headers, name, value):
+    current = headers.get(name, None)
+    if not current:
+        headers[name] = value
+    elif value.lower() not in [item.strip().lower() for item in current.split(',')]:
+        headers[name] = current + ', ' + value
+
+
+def parse_accept_encoding(value):
+    codings = {}
+    for item in value.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, param_value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+_negotiated = {} # (Accept-Encoding, offered) -> coding, for the handful of distinct headers browsers send
+
+
+def negotiate_encoding(accept_encoding, offered):
+    # Returns the most preferred of the offered codings, earlier ones winning ties, or None if none is acceptable
+    key = (accept_encoding, offered)
+    try:
+        return _negotiated[key]
+    except KeyError:
+        pass
+    except TypeError: # unhashable offered codings
+        return _negotiate_encoding(accept_encoding, offered)
+    best = _negotiated[key] = _negotiate_encoding(accept_encoding, offered)
+    if len(_negotiated) > 1000:
+        _negotiated.clear()
+    return best
+
+
+def _negotiate_encoding(accept_encoding, offered):
+    codings = parse_accept_encoding(accept_encoding)
+    wildcard = codings.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for coding in offered:
+        quality = codings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class _Signature(object):
+    def __init__(self, fn):
+        # Look through signature-preserving decorators to the handler that actually binds the arguments
+        while hasattr(fn, '__wrapped__'):
+            fn = fn.__wrapped__
+        try:
+            argspec = inspect.getargspec(fn)
+        except TypeError:
+            self.params = None
+            return
+        self.params = tuple(argspec.args[2:])
+        self.required = self.params[:len(self.params)-len(argspec.defaults)] if argspec.defaults else self.params
+        self.accepted = frozenset(self.params)
+        self.keywords = argspec.keywords is not None
+
+    def bind(self, args, kwargs):
+        if self.params is None:
+            return None
+        required = self.required
+        accepted = self.accepted
+        if args:
+            required = required[len(args):]
+            accepted = self.params[len(args):]
+        missing = [name for name in required if name not in kwargs]
+        if missing:
+            return 'Missing arguments: '+' '.join(missing)
+        if not self.keywords:
+            invalid = [name for name in kwargs if name not in accepted]
+            if invalid:
+                return 'Unexpected arguments: '+' '.join(invalid)
+        return None
+
+
+class _DispatchTable(object):
+    def __init__(self, cls):
+        self.methods = {}
+        for method in cls.SUPPORTED_METHODS:
+            fn = getattr(cls, method.lower(), None)
+            if fn is not None:
+                self.methods[method] = (method.lower(), _Signature(fn))
+        if 'HEAD' in cls.SUPPORTED_METHODS and 'HEAD' not in self.methods and 'GET' in self.methods:
+            self.methods['HEAD'] = self.methods['GET']
+        self.allowed = ', '.join(sorted(self.methods))
+
+
+_dispatch_tables = {}
+
+
+def _dispatch_table(cls):
+    table = _dispatch_tables.get(cls)
+    if table is None:
+        table = _dispatch_tables[cls] = _DispatchTable(cls)
+    return table
+
+
 class Resource(object):
     SUPPORTED_METHODS = set(('OPTIONS', 'GET', 'HEAD', 'POST', 'PUT', 'DELETE'))
 
     def __call__(self, request, *args):
-        try:
-            method_name = request.method.lower()
-            if request.method in self.SUPPORTED_METHODS:
-                method = getattr(self, method_name)
-            else:
+        table = _dispatch_table(self.__class__)
+        entry = table.methods.get(request.method)
+        if entry is None:
+            if request.method not in self.SUPPORTED_METHODS:
                 return HTTPResponse(HTTPPreamble(httplib.NOT_IMPLEMENTED))
-        except AttributeError:
-            if not hasattr(self, method_name):
-                get_method = getattr(self, 'get', None)
-                if request.method == 'HEAD' and get_method is not None:
-                    method = get_method
-                else:
-                    return HTTPResponse(HTTPPreamble(httplib.METHOD_NOT_ALLOWED, headers={'Allowed': [method for method in self.SUPPORTED_METHODS if hasattr(self, method.lower())]}))
-            else:
-                raise
+            return HTTPResponse(HTTPPreamble(httplib.METHOD_NOT_ALLOWED, headers={'Allowed': table.allowed}))
 
+        name, signature = entry
         kwargs = dict([(key, value[0]) for key, value in request.arguments.iteritems()])
-        try:
-            return method(request, *args, **kwargs)
-        except TypeError as err:
-            argspec = inspect.getargspec(method)
-            args = argspec.args[2:]
-            keywords = set(kwargs.keys())
-            missing = set(args[:-len(argspec.defaults)] if argspec.defaults else args) - keywords
-            if len(missing) > 0:
-                return HTTPResponse(HTTPPreamble(httplib.BAD_REQUEST), body='Missing arguments: '+' '.join(missing))
-            invalid = keywords - set(args)
-            if not argspec.keywords and len(invalid) > 0:
-                return HTTPResponse(HTTPPreamble(httplib.BAD_REQUEST), body='Unexpected arguments: '+' '.join(invalid))
-            raise
+        error = signature.bind(args, kwargs)
+        if error is not None:
+            return HTTPResponse(HTTPPreamble(httplib.BAD_REQUEST), body=error)
+        return getattr(self, name)(request, *args, **kwargs)
+
+
+_status_lines = {}
+
+
+def _status_line(version, status_code):
+    line = _status_lines.get((version, status_code))
+    if line is None:
+        line = _status_lines[(version, status_code)] = utf8(version + b' ' + str(status_code) + b' ' + httplib.responses[status_code])
+    return line
+
+
+_header_names = {}
+_canonical = _header_names.get
+_dict_getitem, _dict_setitem, _dict_delitem, _dict_contains = dict.__getitem__, dict.__setitem__, dict.__delitem__, dict.__contains__
+_dict_get, _dict_pop, _dict_setdefault = dict.get, dict.pop, dict.setdefault
+
+
+def _normalize_header(name):
+    normalized = '-'.join([word.capitalize() for word in name.split('-')])
+    if len(_header_names) < 1000:
+        _header_names[name] = normalized
+    return normalized
+
+
+class Headers(dict):
+    # Case-insensitive; values are strings, or lists of strings for names added more than once.
+    # Names are canonicalized through _header_names, which is hit for all but the first use of a spelling.
+    __slots__ = ()
+
+    def __init__(self, headers=None, **kwargs):
+        if headers or kwargs:
+            self.update(headers or (), **kwargs)
+
+    def __getitem__(self, name):
+        return _dict_getitem(self, _canonical(name) or _normalize_header(name))
+
+    def __setitem__(self, name, value):
+        _dict_setitem(self, _canonical(name) or _normalize_header(name), value)
+
+    def __delitem__(self, name):
+        _dict_delitem(self, _canonical(name) or _normalize_header(name))
+
+    def __contains__(self, name):
+        return _dict_contains(self, _canonical(name) or _normalize_header(name))
+
+    has_key = __contains__
+
+    def get(self, name, default=None):
+        return _dict_get(self, _canonical(name) or _normalize_header(name), default)
+
+    def pop(self, name, *default):
+        return _dict_pop(self, _canonical(name) or _normalize_header(name), *default)
+
+    def setdefault(self, name, default=None):
+        return _dict_setdefault(self, _canonical(name) or _normalize_header(name), default)
+
+    def update(self, headers=(), **kwargs):
+        for name, value in (headers.iteritems() if isinstance(headers, dict) else headers):
+            self[name] = value
+        for name, value in kwargs.iteritems():
+            self[name] = value
+
+    def copy(self):
+        return Headers(self)
+
+    def add(self, name, value):
+        name = _canonical(name) or _normalize_header(name)
+        current = _dict_get(self, name)
+        if current is None:
+            _dict_setitem(self, name, value)
+        elif isinstance(current, list):
+            current.append(value)
+        else:
+            _dict_setitem(self, name, [current, value])
+
+    def get_list(self, name):
+        value = self.get(name)
+        if value is None:
+            return []
+        return value if isinstance(value, list) else [value]
 
 
 class HTTPPreamble(object):
+    __slots__ = ('status_code', 'reason', 'version', 'headers', '_cookies')
+
     def __init__(self, status_code=httplib.OK, reason=None, version='HTTP/1.1', headers=None, cookies=None):
         self.status_code = status_code
         self.reason = reason
         self.version = version
-        self.headers = headers or {}
-        self.cookies = SimpleCookie()
+        self.headers = headers if isinstance(headers, Headers) else Headers(headers or ())
+        self._cookies = None
         for key, value in (cookies or {}).iteritems():
             if isinstance(value, dict):
                 self.cookies[key] = value['value']
-                for name, morsel_attr in value:
-                    self.cookies[key][name] = morsel_attr
+                for name, morsel_attr in value.iteritems():
+                    if name != 'value':
+                        self.cookies[key][name] = morsel_attr
             else:
                 self.cookies[key] = value
 
+    @property
+    def cookies(self):
+        # Most responses set no cookies, so only build the jar when it's asked for
+        if self._cookies is None:
+            self._cookies = SimpleCookie()
+        return self._cookies
+
     def __str__(self):
-        lines = [utf8(self.version + b' ' + str(self.status_code) + b' ' + (self.reason or httplib.responses[self.status_code]))]
+        if self.reason is None:
+            lines = [_status_line(self.version, self.status_code)]
+        else:
+            lines = [utf8(self.version + b' ' + str(self.status_code) + b' ' + self.reason)]
         for name, values in self.headers.iteritems():
-            lines.extend([utf8(name) + b': ' + utf8(value) for value in (values if isinstance(values, list) else [values])])
-        lines.extend([str(cookie) for cookie in self.cookies.itervalues()])
-        return b'\r\n'.join(lines) + b'\r\n\r\n'
+            if isinstance(values, list):
+                lines.extend([utf8(name) + b': ' + utf8(value) for value in values])
+            else:
+                lines.append(utf8(name) + b': ' + (values if isinstance(values, bytes) else utf8(values)))
+        if self._cookies:
+            lines.extend([str(cookie) for cookie in self._cookies.itervalues()])
+        lines.append(b'\r\n')
+        return b'\r\n'.join(lines)
 
 
 class HTTPResponse(object):
+    __slots__ = ('preamble', 'body')
+
     def __init__(self, preamble, body=''):
         self.preamble = preamble
         self.body = body
@@ -160,81 +578,159 @@ class HTTPResponse(object):
         return str(self.preamble)+self.body
 
 
-class _GzipEncoder(object):
-    def __init__(self, request, preamble):
-        preamble.headers['Vary'] = preamble.headers.get('Vary', '') + ',Accept-Encoding'
-        self._accepted = 'gzip' in request.headers.get('Accept-Encoding', '').replace(' ','').split(',')
-        if self._accepted:
-            self._value = BytesIO()
-            self._file = GzipFile(mode='wb', fileobj=self._value)
-            preamble.headers['Content-Encoding'] = preamble.headers.get('Content-Encoding', '') + ',gzip'
+class _CompressionEncoder(object):
+    codings = ('gzip', 'deflate')
+    level = 6
+    wbits = zlib.MAX_WBITS
+    mem_level = 8
+    min_size = 256 # bytes; smaller bodies don't shrink enough to be worth it
+    skip_types = ('image/', 'video/', 'audio/', 'font/woff', 'application/zip', 'application/gzip', 'application/x-gzip',
+                  'application/x-bzip2', 'application/x-7z-compressed', 'application/x-rar-compressed', 'application/octet-stream')
+    compressible_types = ('image/svg+xml', 'image/x-icon', 'image/bmp')
+    # Overridden settings go in the instance dict, which is only created when there are any
+    __slots__ = ('_request', '_preamble', '_compressor', '_started', '__dict__')
+
+    def __init__(self, request, preamble, level=None, wbits=None, mem_level=None, min_size=None, skip_types=None, codings=None):
+        self._request = request
+        self._preamble = preamble
+        self._compressor = None
+        self._started = False
+        if level is not None:
+            self.level = level
+        if wbits is not None:
+            self.wbits = wbits
+        if mem_level is not None:
+            self.mem_level = mem_level
+        if min_size is not None:
+            self.min_size = min_size
+        if skip_types is not None:
+            self.skip_types = skip_types
+        if codings is not None:
+            self.codings = codings
+
+    def _compressible(self, content_type):
+        if content_type is None:
+            return True
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type in self.compressible_types:
+            return True
+        for skip_type in self.skip_types:
+            if content_type == skip_type or (skip_type.endswith('/') and content_type.startswith(skip_type)):
+                return False
+        return True
+
+    def _start(self, length):
+        # Called with the size of the whole body on finish, or None when the body is being streamed
+        self._started = True
+        headers = self._preamble.headers
+        status_code = self._preamble.status_code
+        if status_code < 200 or status_code in (httplib.NO_CONTENT, httplib.NOT_MODIFIED) or 'Content-Encoding' in headers:
+            return
+        if not self._compressible(headers.get('Content-Type', None)):
+            return
+        append_header(headers, 'Vary', 'Accept-Encoding')
+
+        if length is None and 'Content-Length' in headers:
+            length = int(headers['Content-Length'])
+        if length is not None and (length == 0 or length < self.min_size):
+            return
+        coding = negotiate_encoding(self._request.headers.get('Accept-Encoding', ''), self.codings)
+        if coding is None:
+            return
+        # A window size offset by 16 selects gzip framing; deflate is the zlib format
+        self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits + 16 if coding == 'gzip' else self.wbits, self.mem_level)
+        headers['Content-Encoding'] = coding
+        headers.pop('Content-Length', None)
 
     def encode(self, data):
-        if self._accepted:
-            self._file.write(data)
-            self._file.flush()
-            data = self._value.getvalue()
-            self._value.truncate(0)
-            self._value.seek(0)
-        return data
+        if not self._started:
+            self._start(None)
+        if self._compressor is None or len(data) == 0:
+            return data
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
 
     def finish(self, data):
-        if self._accepted:
-            data = self.encode(data)
-            self._file.close()
-        return data
+        if not self._started:
+            self._start(len(data))
+        if self._compressor is None:
+            return data
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
 
 
 class HTTPStream(object):
-    def __init__(self, request, preamble, encoders=[_GzipEncoder]):
+    __slots__ = ('_request', '_preamble', '_buffer', '_headers_written', '_finished', '_chunked', '_encoders', '_record')
+
+    def __init__(self, request, preamble, encoders=(_CompressionEncoder,)):
         self._request = request
         self._preamble = preamble
         self._buffer = []
         self._headers_written = False
         self._finished = False
         self._chunked = False
-        self._encoders = [encoder(request, preamble) for encoder in encoders]
-        self._preamble.headers.setdefault('Date', http_date(None))
+        self._encoders = [encoder(request, preamble) for encoder in encoders] if encoders else ()
+        self._record = getattr(request, 'vortex_record', None)
+        if 'Date' not in self._preamble.headers:
+            self._preamble.headers['Date'] = current_http_date()
 
     def write(self, data):
-        self._buffer.append(data)
+        if data:
+            self._buffer.append(data)
 
     def _write_headers(self):
         self._request.write(str(self._preamble))
         self._headers_written = True
 
-    def flush(self, data=''):
+    def flush(self, data='', callback=None):
         if self._finished:
             raise RuntimeError('Cannot flush a finished stream')
+        started = time.time() if self._record is not None else None
         self.write(data)
+        # Encoders may still adjust the headers when they see the first chunk, so encode before writing them
+        body = self._encode_body()
         if not self._headers_written:
-            self._preamble.headers.setdefault('Transfer-Encoding', 'chunked')
+            if 'Content-Length' not in self._preamble.headers:
+                self._preamble.headers.setdefault('Transfer-Encoding', 'chunked')
+                self._chunked = True
             self._write_headers()
-            self._chunked = True
-        self._flush_body(self._encode_body())
+        self._flush_body(body, callback)
+        if started is not None:
+            self._record.serialization += time.time() - started
 
-    def _encode_body(self):
-        body = ''.join(self._buffer)
+    def _encode_body(self, final=False):
+        buffer = self._buffer
+        body = buffer[0] if len(buffer) == 1 else ''.join(buffer)
+        if self._record is not None:
+            self._record.bytes_in += len(body)
+        if not body and not final and self._headers_written:
+            # Encoders have seen the headers already, and have nothing to add to an empty chunk
+            return body
         for encoder in self._encoders:
-            body = encoder.encode(body)
+            body = encoder.finish(body) if final else encoder.encode(body)
+        if self._record is not None:
+            self._record.bytes_out += len(body)
         return body
 
-    def _flush_body(self, body):
-        del self._buffer[:]
+    def _flush_body(self, body, callback=None):
+        if self._buffer:
+            del self._buffer[:]
         len_body = len(body)
         if len_body > 0:
             if self._chunked:
+                # Frame the chunk with separate writes rather than copying the body to append the trailing CRLF
                 self._request.write(hex(len_body)[2:]+'\r\n')
-                body += '\r\n'
-            self._request.write(body)
+                self._request.write(body)
+                body = '\r\n'
+            if callback is None:
+                self._request.write(body)
+            else:
+                self._request.write(body, callback)
+        elif callback is not None:
+            self._request.write('', callback)
 
     def finish(self, data=''):
+        started = time.time() if self._record is not None else None
         self.write(data)
-        body = self._encode_body()
-        final = ''
-        for encoder in self._encoders:
-            final = encoder.finish(final)
-        body += final
+        body = self._encode_body(final=True)
         if not self._headers_written:
             self._preamble.headers.setdefault('Content-Length', str(len(body)))
             self._write_headers()
@@ -243,30 +739,238 @@ class HTTPStream(object):
             self._request.write('0\r\n\r\n')
         self._request.finish()
         self._finished = True
+        if started is not None:
+            self._record.serialization += time.time() - started
+            self._record.finish(self._preamble.status_code)
+        for callback in getattr(self._request, 'vortex_finish_callbacks', ()):
+            callback(self._request)
+
+
+class JSONStream(object):
+    threshold = 1000 # list items above which coerce_response streams instead of serializing in one go
+
+    def __init__(self, items, preamble=None, chunk_size=16*2**10):
+        self.items = items
+        self.preamble = preamble or _typed_preamble('application/json')
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        # Serializes the items one at a time as a JSON array, batched into chunks of about chunk_size bytes
+        pending = ['[']
+        size = 0
+        separator = ''
+        for item in self.items:
+            encoded = json_dumps(item)
+            pending.append(separator)
+            pending.append(encoded)
+            separator = ','
+            size += len(encoded) + 1
+            if size >= self.chunk_size:
+                yield ''.join(pending)
+                pending = []
+                size = 0
+        pending.append(']')
+        yield ''.join(pending)
+
+    def send(self, request, encoders=(_CompressionEncoder,)):
+        chunks = self.chunks()
+        # Produce the first chunk before any headers are written, so that errors can still become a 500
+        pending = [next(chunks)]
+        stream = HTTPStream(request, self.preamble, encoders)
+        def next_chunk():
+            chunk = pending.pop()
+            try:
+                following = next(chunks, None)
+            except:
+                # Too late for an error status; the truncated array tells the client something went wrong
+                logger.exception('Error while streaming JSON for %s', request)
+                following = None
+            if following is None:
+                stream.finish(chunk)
+            else:
+                pending.append(following)
+                stream.flush(chunk, next_chunk)
+        next_chunk()
+
+
+_NOT_FOUND = object()
+_resolution_caches = WeakSet()
+
+
+def invalidate_resolution(resource):
+    for cache in list(_resolution_caches):
+        cache.invalidate(resource)
+
+
+def _resolution_ttl(parent, name, ttl):
+    resolution_ttl = getattr(parent, 'resolution_ttl', None)
+    if resolution_ttl is not None:
+        child_ttl = resolution_ttl(name)
+        if child_ttl is not None and (ttl is None or child_ttl < ttl):
+            return max(0, child_ttl)
+    return ttl
+
+
+class ResolutionCache(object):
+    def __init__(self, max_entries=1024):
+        self._paths = LRUCache(max_entries=max_entries, on_evict=self._evicted)
+        self._dependents = {} # id(resource) -> set of paths traversing it
+        _resolution_caches.add(self)
+
+    @property
+    def hits(self):
+        return self._paths.hits
+
+    @property
+    def misses(self):
+        return self._paths.misses
+
+    def stats(self):
+        return self._paths.stats()
+
+    def get(self, path):
+        entry = self._paths.get(path)
+        return entry[0] if entry is not None else None
+
+    def set(self, path, resource, chain, ttl=None):
+        # The chain holds strong references, so the ids stay valid while the entry is cached
+        self._paths.set(path, (resource, chain), ttl=ttl)
+        for parent in chain:
+            self._dependents.setdefault(id(parent), set()).add(path)
+
+    def invalidate(self, resource=None):
+        if resource is None:
+            self._paths.clear()
+        else:
+            for path in self._dependents.pop(id(resource), ()):
+                self._paths.pop(path)
+
+    def _evicted(self, path, entry):
+        for parent in entry[1]:
+            paths = self._dependents.get(id(parent))
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._dependents[id(parent)]
 
 
 class Application(object):
-    def __init__(self, root=None):
+    def __init__(self, root=None, resolution_cache=None, encoders=(_CompressionEncoder,), stats=None, admission=(), profiler=None):
         self.root = root
+        self.resolution_cache = resolution_cache
+        self.encoders = encoders
+        self.stats = stats
+        self.admission = admission
+        self.profiler = profiler
+
+    def resolve(self, path):
+        cache = self.resolution_cache
+        if cache is not None:
+            resource = cache.get(path)
+            if resource is not None:
+                return resource if resource is not _NOT_FOUND else None
+        return self._traverse(self.root, path.split('/')[1:], [], None, path)
+
+    def _traverse(self, resource, parts, chain, ttl, path):
+        # Resources may limit how long a child stays in the resolution cache through resolution_ttl(name), and may
+        # return a Future for a child that is still being built, in which case traversal resumes once it is ready
+        for i, part in enumerate(parts):
+            if resource is None or not hasattr(resource, '__getitem__'):
+                resource = _NOT_FOUND
+                break
+            chain.append(resource)
+            name = urllib.unquote(part)
+            try:
+                resource = resource[name]
+            except KeyError:
+                ttl = _resolution_ttl(chain[-1], name, ttl) # the child may appear later
+                resource = _NOT_FOUND
+                break
+            if is_future(resource):
+                return self._traverse_later(resource, name, parts[i+1:], chain, ttl, path)
+            ttl = _resolution_ttl(chain[-1], name, ttl)
+
+        if self.resolution_cache is not None and ttl != 0:
+            self.resolution_cache.set(path, resource, tuple(chain), ttl)
+        return resource if resource is not _NOT_FOUND else None
+
+    @tornado.gen.coroutine
+    def _traverse_later(self, future, name, parts, chain, ttl, path):
+        try:
+            resource = yield future
+        except KeyError:
+            raise tornado.gen.Return(None)
+        resource = self._traverse(resource, parts, chain, _resolution_ttl(chain[-1], name, ttl), path)
+        if is_future(resource):
+            resource = yield resource
+        raise tornado.gen.Return(resource)
+
+    def dispatch(self, request):
+        resource = self.resolve(request.path)
+        if is_future(resource):
+            return _then(resource, lambda resource: self._dispatch(request, resource))
+        return self._dispatch(request, resource)
+
+    def _dispatch(self, request, resource):
+        record = getattr(request, 'vortex_record', None)
+        if record is not None:
+            record.resolved(resource)
+        if resource is None:
+            return HTTPResponse(HTTPPreamble(httplib.NOT_FOUND))
+        if not hasattr(resource, '__call__'):
+            return HTTPResponse(HTTPPreamble(httplib.METHOD_NOT_ALLOWED))
+        return resource(request)
 
     def __call__(self, request):
+        if self.stats is not None:
+            request.vortex_record = self.stats.start(request)
+        if self.admission and not self._admit(request):
+            return
+        if self.profiler is not None and self.profiler.triggered(request):
+            self.profiler.run(self, request)
+            return
+        self.handle(request)
+
+    def handle(self, request):
+        # Dispatches and answers a request that has already been admitted
         try:
-            resource = self.root
-            response = None
-            for part in request.path.split('/')[1:]:
-                not_found = False
-                if resource is not None and hasattr(resource, '__getitem__'):
-                    try:
-                        resource = resource[urllib.unquote(part)]
-                    except KeyError:
-                        not_found = True
-                else:
-                    not_found = True
-                if not_found:
-                    response = HTTPResponse(HTTPPreamble(httplib.NOT_FOUND))
-                    break
-            if response is None:
-                response = coerce_response(resource(request)) if hasattr(resource, '__call__') else HTTPResponse(HTTPPreamble(httplib.METHOD_NOT_ALLOWED))
+            response = self.dispatch(request)
+        except:
+            response = HTTPResponse(HTTPPreamble(httplib.INTERNAL_SERVER_ERROR), traceback.format_exc())
+        self._respond(request, response)
+
+    def _admit(self, request):
+        # Controllers run in order before traversal; the first to refuse answers straight away, skipping the
+        # encoders and error logging, and those that admitted the request are released once it finishes
+        request.vortex_finish_callbacks = []
+        for controller in self.admission:
+            response = controller.admit(request)
+            if response is not None:
+                HTTPStream(request, response.preamble, encoders=()).finish(response.body)
+                return False
+            release = getattr(controller, 'release', None)
+            if release is not None:
+                request.vortex_finish_callbacks.append(release)
+        return True
+
+    def _respond(self, request, response):
+        try:
+            if isinstance(response, GeneratorType):
+                response = tornado.gen.coroutine(lambda: response)()
+            if is_future(response):
+                # Finish the response once the handler's result is ready, without blocking the IOLoop
+                IOLoop.current().add_future(response, lambda future: self._resolved(request, future))
+                return
+            record = getattr(request, 'vortex_record', None)
+            if record is not None:
+                record.handled()
+            if isinstance(response, HTTPStream):
+                # The handler has taken ownership of the stream, and will finish it itself
+                return
+            response = coerce_response(response)
+            if isinstance(response, JSONStream):
+                response.send(request, self.encoders)
+                return
         except:
             response = HTTPResponse(HTTPPreamble(httplib.INTERNAL_SERVER_ERROR), traceback.format_exc())
 
@@ -274,19 +978,118 @@ class Application(object):
             if response.preamble.status_code >= 400:
                 logger.log(logging.ERROR if response.preamble.status_code >= 500 else logging.WARNING, '%s\n%s', str(request), str(response))
 
-            HTTPStream(request, response.preamble).finish(response.body)
+            HTTPStream(request, response.preamble, self.encoders).finish(response.body)
+
+    def _resolved(self, request, future):
+        try:
+            response = future.result()
+        except:
+            response = HTTPResponse(HTTPPreamble(httplib.INTERNAL_SERVER_ERROR), traceback.format_exc())
+        self._respond(request, response)
+
+
+def _split_host(host):
+    # 'Example.com.:8080' -> ('example.com', 8080); IPv6 literals keep their brackets
+    host = host.strip().lower()
+    port = None
+    if host.startswith('['):
+        end = host.find(']')
+        if end != -1 and host[end+1:end+2] == ':':
+            host, port = host[:end+1], host[end+2:]
+    elif ':' in host:
+        host, port = host.rsplit(':', 1)
+    if port is not None:
+        try:
+            port = int(port)
+        except ValueError:
+            port = None
+    return host.rstrip('.'), port
+
+
+class _HostNode(object):
+    def __init__(self):
+        self.children = {}
+        self.exact = {}    # port (None for any) -> handler
+        self.wildcard = {} # port (None for any) -> handler for any name below this one
 
 
 class VirtualHost(object):
-    def __init__(self, hosts, default=None):
-        self.hosts = hosts
+    # Hosts are matched in a trie of reversed labels, so lookups cost the same however many hosts are registered.
+    # Patterns are exact names ('example.com'), wildcards covering every subdomain ('*.example.com'), either of
+    # which may be qualified with a port ('example.com:8080'). Exact names beat wildcards, and deeper wildcards
+    # beat shallower ones.
+    def __init__(self, hosts=None, default=None):
+        self._root = _HostNode()
+        self.hosts = {}
         self.default = default
+        for pattern, handler in (hosts or {}).iteritems():
+            self[pattern] = handler
+
+    def _parse(self, pattern):
+        host, port = _split_host(pattern)
+        labels = host.split('.')
+        wildcard = labels[0] == '*'
+        if wildcard:
+            labels = labels[1:]
+        labels.reverse()
+        # hosts is keyed by the normalized pattern too, so 'Example.com.' and 'example.com' are one entry
+        key = host if port is None else '%s:%d' % (host, port)
+        return labels, wildcard, port, key
+
+    def __setitem__(self, pattern, handler):
+        labels, wildcard, port, key = self._parse(pattern)
+        node = self._root
+        for label in labels:
+            node = node.children.setdefault(label, _HostNode())
+        (node.wildcard if wildcard else node.exact)[port] = handler
+        self.hosts[key] = handler
+
+    def __delitem__(self, pattern):
+        labels, wildcard, port, key = self._parse(pattern)
+        if key not in self.hosts:
+            raise KeyError(pattern)
+        path = [self._root]
+        for label in labels:
+            node = path[-1].children.get(label)
+            if node is None:
+                raise KeyError(pattern)
+            path.append(node)
+        del (path[-1].wildcard if wildcard else path[-1].exact)[port]
+        del self.hosts[key]
+        # Prune nodes left empty, so that churning tenants don't leak
+        for label, node in reversed(list(zip(labels, path[1:]))):
+            if node.children or node.exact or node.wildcard:
+                break
+            del path[path.index(node) - 1].children[label]
+
+    def __contains__(self, pattern):
+        return self._parse(pattern)[3] in self.hosts
+
+    def __getitem__(self, pattern):
+        key = self._parse(pattern)[3]
+        if key not in self.hosts:
+            raise KeyError(pattern)
+        return self.hosts[key]
+
+    def lookup(self, host):
+        hostname, port = _split_host(host)
+        labels = hostname.split('.')
+        node = self._root
+        match = None
+        for i in range(len(labels) - 1, -1, -1):
+            if node.wildcard:
+                match = node.wildcard.get(port, node.wildcard.get(None, match))
+            node = node.children.get(labels[i])
+            if node is None:
+                return match
+        if node.exact:
+            return node.exact.get(port, node.exact.get(None, match))
+        return match
 
     def __call__(self, request):
         host_val = request.headers.get('Host')
         if host_val:
-            hostname = host_val.split(':')[0]
-            host = self.hosts.get(request, hostname)
+            host = self.lookup(host_val)
             if host:
                 return host(request)
         return self.default(request) if self.default else HTTPResponse(HTTPPreamble(httplib.BAD_REQUEST), 'Virtual host not found')
@@ -0,0 +1,113 @@
+import heapq
+import math
+import time
+from   weakref import WeakSet
+
+from vortex.responses import HTTPServiceUnavailableResponse, HTTPTooManyRequestsResponse
+
+
+def client_ip(request):
+    return request.remote_ip
+
+
+def cookie(name):
+    # Clients without the cookie are limited by address instead
+    def key(request):
+        morsel = request.cookies.get(name, None)
+        return morsel.value if morsel is not None else request.remote_ip
+    return key
+
+
+def path_prefix(depth=1):
+    # '/users/42/photos' -> '/users' for depth=1
+    def key(request):
+        return '/'.join(request.path.split('/', depth + 1)[:depth + 1])
+    return key
+
+
+class TokenBucket(object):
+    # Each key may make burst requests at once, refilled at rate per second. Buckets are (tokens, updated) tuples
+    # in a plain dict, which is rebuilt every compact_interval without the buckets that have refilled; a full
+    # bucket behaves exactly like a missing one, so this only forgets clients that have gone quiet.
+    def __init__(self, rate, burst=None, key=client_ip, prefix=None, max_keys=10**6, compact_interval=60, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.key = key
+        self.prefix = prefix
+        self.max_keys = max_keys
+        self.compact_interval = compact_interval
+        self.clock = clock
+        self.buckets = {}
+        self.admitted = 0
+        self.rejected = 0
+        self._compact_at = clock() + compact_interval
+
+    def admit(self, request):
+        if self.prefix is not None and not request.path.startswith(self.prefix):
+            return None
+        now = self.clock()
+        if now >= self._compact_at:
+            self.compact(now)
+        key = self.key(request)
+        bucket = self.buckets.get(key)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            self.rejected += 1
+            retry_after = int(math.ceil((1 - tokens) / self.rate))
+            return HTTPTooManyRequestsResponse(headers={'Retry-After': str(retry_after)})
+        self.buckets[key] = (tokens - 1, now)
+        self.admitted += 1
+        if len(self.buckets) > self.max_keys:
+            self.compact(now)
+        return None
+
+    def compact(self, now=None):
+        now = self.clock() if now is None else now
+        # Rebuilding, rather than deleting from, the dict is what gives its memory back
+        self.buckets = dict([(key, bucket) for key, bucket in self.buckets.iteritems()
+                             if bucket[0] + (now - bucket[1]) * self.rate < self.burst])
+        if len(self.buckets) > self.max_keys:
+            # Still too many clients mid-burst; forget the ones that have been idle longest
+            self.buckets = dict(heapq.nlargest(self.max_keys * 3 // 4, self.buckets.iteritems(), key=lambda item: item[1][1]))
+        self._compact_at = now + self.compact_interval
+
+    def stats(self):
+        return {
+            'keys': len(self.buckets),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+class ConcurrencyLimit(object):
+    # Requests are held weakly, so one abandoned without ever finishing stops counting once it's collected
+    def __init__(self, max_in_flight, retry_after=1):
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.rejected = 0
+        self._in_flight = WeakSet()
+
+    @property
+    def in_flight(self):
+        return len(self._in_flight)
+
+    def admit(self, request):
+        if len(self._in_flight) >= self.max_in_flight:
+            self.rejected += 1
+            return HTTPServiceUnavailableResponse(body='Server is busy', headers={'Retry-After': str(self.retry_after)})
+        self._in_flight.add(request)
+        self.admitted += 1
+        return None
+
+    def release(self, request):
+        self._in_flight.discard(request)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._in_flight),
+            'max_in_flight': self.max_in_flight,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,205 @@
+from   collections import deque
+import struct
+from   tornado.concurrent import Future
+from   tornado.ioloop import IOLoop, PeriodicCallback
+import zlib
+
+from vortex import HTTPPreamble, HTTPStream, Resource, negotiate_encoding
+
+_GZIP_HEADER = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+_FINAL_BLOCK = '\x03\x00' # an empty, final fixed-Huffman deflate block
+
+
+def _event_text(id, event, data):
+    lines = ['id: %d' % id]
+    if event is not None:
+        lines.append('event: ' + event)
+    lines.extend(['data: ' + line for line in data.split('\n')])
+    return '\n'.join(lines) + '\n\n'
+
+
+def _writing(request):
+    # Write callbacks can't count what's unsent: a connection keeps only the latest one, and runs it when the next
+    # write completes. The stream knows whether anything is still buffered; without one, assume nothing is.
+    stream = getattr(request.connection, 'stream', None)
+    return stream is not None and stream.writing()
+
+
+class _Identity(object):
+    coding = None
+
+    def encode(self, text):
+        return text
+
+
+class _Gzip(object):
+    # One raw deflate stream shared by every gzip subscriber. Each segment ends with a full flush, so it refers to
+    # nothing before it and subscribers can join between any two; each one gets its own gzip header and trailer.
+    coding = 'gzip'
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def encode(self, text):
+        return self._compressor.compress(text) + self._compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+class _Subscriber(object):
+    __slots__ = ('request', 'stream', 'variant', 'pending', 'crc', 'size')
+
+    def __init__(self, request, stream, variant):
+        self.request = request
+        self.stream = stream
+        self.variant = variant
+        self.pending = 0
+        self.crc = 0
+        self.size = 0
+
+
+class BroadcastResource(Resource):
+    # Server-Sent Events to clients that accept text/event-stream, long-polling for the rest. A published event is
+    # encoded and chunk-framed once per encoding, and the same bytes are written to every subscriber using it.
+    # Subscribers whose connection hasn't emptied its write buffer in max_pending events are dropped.
+    def __init__(self, heartbeat=15, max_pending=64, history=100, poll_timeout=30, level=6, retry=None):
+        Resource.__init__(self)
+        self.heartbeat = heartbeat
+        self.max_pending = max_pending
+        self.poll_timeout = poll_timeout
+        self.retry = retry
+        self.history = deque(maxlen=history) # (id, event, data)
+        self.last_id = 0
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+        self._variants = {None: _Identity(), 'gzip': _Gzip(level)}
+        self._waiters = []
+        self._heartbeat = None
+
+    def get(self, request, since=None):
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return self.subscribe(request)
+        return self.poll(request, since)
+
+    def subscribe(self, request):
+        coding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), ('gzip',))
+        variant = self._variants[coding]
+        headers = {
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+        stream = HTTPStream(request, HTTPPreamble(headers=headers), encoders=())
+        subscriber = _Subscriber(request, stream, variant)
+
+        # Catch up from Last-Event-ID, then join the shared stream
+        text = 'retry: %d\n\n' % self.retry if self.retry is not None else ':\n\n'
+        try:
+            last_id = int(request.headers.get('Last-Event-ID', self.last_id))
+        except ValueError:
+            last_id = self.last_id
+        text += ''.join([_event_text(*event) for event in self.history if event[0] > last_id])
+        self._count(subscriber, text)
+        body = variant.encode(text)
+        stream.flush(_GZIP_HEADER + body if coding == 'gzip' else body)
+
+        self.subscribers.add(subscriber)
+        set_close_callback = getattr(request.connection, 'set_close_callback', None)
+        if set_close_callback is not None:
+            set_close_callback(lambda: self.subscribers.discard(subscriber))
+        if self._heartbeat is None and self.heartbeat:
+            self._heartbeat = PeriodicCallback(self._beat, self.heartbeat * 1000)
+            self._heartbeat.start()
+        return stream
+
+    def poll(self, request, since=None):
+        try:
+            since = int(since) if since is not None else self.last_id
+        except ValueError:
+            since = self.last_id
+        events = [self._event_dict(*event) for event in self.history if event[0] > since]
+        if events:
+            return events
+        future = Future()
+        self._waiters.append(future)
+        def timed_out():
+            if not future.done():
+                self._waiters.remove(future)
+                future.set_result([])
+        IOLoop.current().call_later(self.poll_timeout, timed_out)
+        return future
+
+    def publish(self, data, event=None):
+        self.last_id += 1
+        self.published += 1
+        self.history.append((self.last_id, event, data))
+        waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            future.set_result([self._event_dict(self.last_id, event, data)])
+        self._broadcast(_event_text(self.last_id, event, data))
+        return self.last_id
+
+    def close(self):
+        # Ends every subscription cleanly, with the trailer gzip subscribers need
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+            self._heartbeat = None
+        for subscriber in list(self.subscribers):
+            self._finish(subscriber)
+
+    def stats(self):
+        return {
+            'subscribers': len(self.subscribers),
+            'published': self.published,
+            'dropped': self.dropped,
+            'waiting': len(self._waiters),
+        }
+
+    def _event_dict(self, id, event, data):
+        return {'id': id, 'event': event, 'data': data}
+
+    def _beat(self):
+        if not self.subscribers:
+            self._heartbeat.stop()
+            self._heartbeat = None
+            return
+        self._broadcast(':\n\n')
+
+    def _broadcast(self, text):
+        frames = {}
+        for subscriber in list(self.subscribers):
+            if not _writing(subscriber.request):
+                subscriber.pending = 0
+            elif subscriber.pending >= self.max_pending:
+                self._drop(subscriber)
+                continue
+            variant = subscriber.variant
+            frame = frames.get(variant)
+            if frame is None:
+                body = variant.encode(text)
+                frame = frames[variant] = '%x\r\n%s\r\n' % (len(body), body)
+            self._count(subscriber, text)
+            subscriber.pending += 1
+            subscriber.request.write(frame)
+
+    def _count(self, subscriber, text):
+        if subscriber.variant.coding == 'gzip':
+            subscriber.crc = zlib.crc32(text, subscriber.crc)
+            subscriber.size += len(text)
+
+    def _drop(self, subscriber):
+        self.subscribers.discard(subscriber)
+        self.dropped += 1
+        close = getattr(subscriber.request.connection, 'close', None)
+        if close is not None:
+            close()
+        else:
+            self._finish(subscriber)
+
+    def _finish(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if subscriber.variant.coding == 'gzip':
+            subscriber.stream.finish(_FINAL_BLOCK + struct.pack('<LL', subscriber.crc & 0xffffffff, subscriber.size & 0xffffffff))
+        else:
+            subscriber.stream.finish()
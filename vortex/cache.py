@@ -0,0 +1,122 @@
+from   collections import OrderedDict
+import time
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    # Expired entries are dropped when looked up, and swept out every sweep_interval seconds by whichever get or set
+    # of an expiring entry comes next, so the ones nobody asks for again don't stay around forever
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, sizeof=len, on_evict=None, clock=time.time,
+                 sweep_interval=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries = OrderedDict() # key -> (value, size, expires)
+        self._sweep_at = clock() + sweep_interval
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def get(self, key, default=None, count=True):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            now = self.clock()
+            if entry[2] <= now:
+                self._evicted(key, entry)
+                entry = None
+            if now >= self._sweep_at:
+                self.sweep(now)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+        self._entries[key] = entry
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def expires(self, key):
+        # The absolute time key expires at, or None if it never does or isn't cached
+        entry = self._entries.get(key)
+        return entry[2] if entry is not None else None
+
+    def set(self, key, value, size=None, ttl=None):
+        self.pop(key)
+        size = (self.sizeof(value) if self.max_bytes is not None else 0) if size is None else size
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        ttl = self.ttl if ttl is None else ttl
+        expires = None
+        if ttl is not None:
+            now = self.clock()
+            if now >= self._sweep_at:
+                self.sweep(now)
+            expires = now + ttl
+        self._entries[key] = (value, size, expires)
+        self.size += size
+        while (self.max_entries is not None and len(self._entries) > self.max_entries) or (self.max_bytes is not None and self.size > self.max_bytes):
+            self._evicted(*self._entries.popitem(last=False))
+        return True
+
+    __setitem__ = set
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self.size -= entry[1]
+        if self.on_evict is not None:
+            self.on_evict(key, entry[0])
+        return entry[0]
+
+    def __delitem__(self, key):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def clear(self):
+        for key in list(self._entries):
+            self.pop(key)
+
+    def sweep(self, now=None):
+        now = self.clock() if now is None else now
+        for key, entry in self._entries.items():
+            if entry[2] is not None and entry[2] <= now:
+                del self._entries[key]
+                self._evicted(key, entry)
+        self._sweep_at = now + self.sweep_interval
+
+    def _evicted(self, key, entry):
+        self.evictions += 1
+        self.size -= entry[1]
+        if self.on_evict is not None:
+            self.on_evict(key, entry[0])
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
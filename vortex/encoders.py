@@ -1,4 +1,14 @@
 # All encoders should technically be defined here, but vortex.HTTPStream uses
-# GzipEncoder by default, which would create a circular dependency. Therefore,
-# it's defined in the root module, but exposed publicly here.
-from vortex import _GzipEncoder as GzipEncoder
+# CompressionEncoder by default, which would create a circular dependency.
+# Therefore, it's defined in the root module, but exposed publicly here.
+from vortex import _CompressionEncoder as CompressionEncoder
+
+
+class GzipEncoder(CompressionEncoder):
+    __slots__ = ()
+    codings = ('gzip',)
+
+
+class DeflateEncoder(CompressionEncoder):
+    __slots__ = ()
+    codings = ('deflate',)
@@ -0,0 +1,120 @@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+import time
+from   tornado.concurrent import Future
+from   tornado.ioloop import IOLoop
+
+from vortex.responses import HTTPServiceUnavailableResponse
+
+
+def _timed(fn, args, kwargs):
+    # Module-level so that it can be pickled for process pools
+    start = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - start
+
+
+def _timed_pickled(call):
+    # The futures backport loses errors pickling calls and results in its feeder threads, leaving the future
+    # pending forever; pickling them here instead makes such errors fail the call
+    fn, args, kwargs = pickle.loads(call)
+    return pickle.dumps(_timed(fn, args, kwargs), pickle.HIGHEST_PROTOCOL)
+
+
+class WorkerPool(object):
+    def __init__(self, max_workers=4, max_queue=None, processes=False, executor=None, retry_after=1):
+        if executor is None:
+            executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            if executor_class is None:
+                raise ImportError('WorkerPool requires concurrent.futures (the "futures" package on Python 2)')
+            executor = executor_class(max_workers)
+        self.executor = executor
+        self.processes = ProcessPoolExecutor is not None and isinstance(executor, ProcessPoolExecutor)
+        self.max_workers = max_workers
+        self.max_queue = max_workers * 4 if max_queue is None else max_queue
+        self.retry_after = retry_after
+        self.pending = 0 # queued or running; only touched from the IOLoop thread
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_time = 0.0
+        self.created = time.time()
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_workers + self.max_queue
+
+    def submit(self, fn, *args, **kwargs):
+        # Returns a Future resolved on the calling IOLoop, or None if the pool is saturated
+        if self.saturated:
+            self.rejected += 1
+            return None
+        future = Future()
+        if self.processes:
+            try:
+                call = pickle.dumps((fn, args, kwargs), pickle.HIGHEST_PROTOCOL)
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+                return future
+            timed = self.executor.submit(_timed_pickled, call)
+        else:
+            timed = self.executor.submit(_timed, fn, args, kwargs)
+        self.pending += 1
+        self.submitted += 1
+        IOLoop.current().add_future(timed, lambda timed: self._done(timed, future))
+        return future
+
+    def _done(self, timed, future):
+        self.pending -= 1
+        if timed.exception() is not None:
+            self.failed += 1
+            if hasattr(timed, 'exception_info'): # the Python 2 backport keeps the worker's traceback
+                exception, tb = timed.exception_info()
+                future.set_exc_info((type(exception), exception, tb))
+            else:
+                future.set_exception(timed.exception())
+            return
+        self.completed += 1
+        result, elapsed = pickle.loads(timed.result()) if self.processes else timed.result()
+        self.busy_time += elapsed
+        future.set_result(result)
+
+    def stats(self):
+        elapsed = time.time() - self.created
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'running': min(self.pending, self.max_workers),
+            'queued': max(0, self.pending - self.max_workers),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'utilization': self.busy_time / (elapsed * self.max_workers) if elapsed > 0 else 0.0,
+        }
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+
+def offload(pool):
+    # The handler runs on a worker, so it must return its response rather than write to the request or an HTTPStream
+    if pool.processes:
+        raise ValueError('offload needs a thread pool; requests and resources cannot be sent to other processes')
+    def wrap1(fn):
+        def wrap2(self, request, *args, **kwargs):
+            future = pool.submit(fn, self, request, *args, **kwargs)
+            if future is None:
+                return HTTPServiceUnavailableResponse(body='Server is busy', headers={'Retry-After': str(pool.retry_after)})
+            return future
+        wrap2.__wrapped__ = fn
+        return wrap2
+    return wrap1
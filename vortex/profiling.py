@@ -0,0 +1,173 @@
+import cProfile
+import httplib
+import marshal
+import os.path
+import pstats
+import random
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+import traceback
+from   tornado.concurrent import is_future
+import tornado.gen
+from   tornado.ioloop import IOLoop
+import tornado.web
+from   types import GeneratorType
+
+from vortex import HTTPPreamble, HTTPResponse, Resource, _then
+from vortex.responses import HTTPNotFoundResponse, HTTPOkResponse
+from vortex.stats import _resource_name
+
+
+class Profiler(object):
+    # Profiles the requests that carry a token from token() in the header or argument, plus a sample_rate fraction
+    # of all requests. Application only consults it when one is configured, so by default nothing changes.
+    def __init__(self, secret=None, header='X-Vortex-Profile', argument='vortex_profile', sample_rate=0.0, random=random.random):
+        self.secret = secret
+        self.header = header
+        self.argument = argument
+        self.sample_rate = sample_rate
+        self.random = random
+        self.resources = {} # resource name -> [requests, pstats.Stats]
+
+    def token(self):
+        return tornado.web.create_signed_value(self.secret, 'vortex_profile', '1')
+
+    def triggered(self, request):
+        value = request.headers.get(self.header, None)
+        values = request.arguments.pop(self.argument, None) # so it's never bound as a handler argument
+        if value is None and values:
+            value = values[-1]
+        if value is not None and self.secret is not None:
+            if tornado.web.decode_signed_value(self.secret, 'vortex_profile', value, max_age_days=1) is not None:
+                return True
+        return self.sample_rate > 0 and self.random() < self.sample_rate
+
+    def run(self, application, request):
+        # The profiler is only enabled while this request's code is on the stack: traversal and the handler first,
+        # then again when an asynchronous result arrives, around the rest of the response up to HTTPStream.finish
+        profile = cProfile.Profile()
+        name = [None]
+        def finished(request):
+            self._aggregate(name[0] or request.path, profile)
+        request.vortex_finish_callbacks = getattr(request, 'vortex_finish_callbacks', None) or []
+        request.vortex_finish_callbacks.append(finished)
+
+        def dispatch(resource):
+            name[0] = _resource_name(resource)
+            return application._dispatch(request, resource)
+
+        profile.enable()
+        try:
+            resource = application.resolve(request.path)
+            response = _then(resource, dispatch)
+        except:
+            response = HTTPResponse(HTTPPreamble(httplib.INTERNAL_SERVER_ERROR), traceback.format_exc())
+        if isinstance(response, GeneratorType):
+            response = tornado.gen.coroutine(lambda: response)()
+        if not is_future(response):
+            try:
+                application._respond(request, response)
+            finally:
+                profile.disable()
+            return
+        profile.disable()
+        def resolved(future):
+            profile.enable()
+            try:
+                application._resolved(request, future)
+            finally:
+                profile.disable()
+        IOLoop.current().add_future(response, resolved)
+
+    def _aggregate(self, name, profile):
+        entry = self.resources.get(name)
+        if entry is None:
+            self.resources[name] = [1, pstats.Stats(profile)]
+        else:
+            entry[0] += 1
+            entry[1].add(profile)
+
+    def reset(self, name=None):
+        if name is None:
+            self.resources.clear()
+        else:
+            self.resources.pop(name, None)
+
+    def summary(self):
+        return dict([(name, {'requests': requests, 'total_time': stats.total_tt})
+                     for name, (requests, stats) in self.resources.iteritems()])
+
+    def pstats_dump(self, name):
+        # Loadable with pstats.Stats once written to a file
+        return marshal.dumps(self.resources[name][1].stats)
+
+    def text(self, name, sort='cumulative', limit=50):
+        out = StringIO.StringIO()
+        stats = self.resources[name][1]
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def collapsed(self, name, max_depth=32, min_share=1e-6):
+        # cProfile only records caller -> callee edges, not whole stacks, so each function's own time is spread over
+        # its callers in proportion to the time spent under each, recursively. Good enough for flame graphs.
+        stats = self.resources[name][1].stats
+        stacks = {}
+
+        def record(path, weight):
+            key = ';'.join([_label(func) for func in reversed(path)])
+            stacks[key] = stacks.get(key, 0.0) + weight
+
+        def walk(path, weight):
+            callers = stats[path[-1]][4]
+            if not callers or len(path) >= max_depth or weight < min_share:
+                record(path, weight)
+                return
+            total = float(sum([info[3] for info in callers.itervalues()]))
+            for caller, info in callers.iteritems():
+                share = weight * (info[3] / total if total else 1.0 / len(callers))
+                if caller in path: # recursion; stop the stack here rather than loop
+                    record(path, share)
+                else:
+                    walk(path + [caller], share)
+
+        for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+            if tt > 0:
+                walk([func], tt)
+        return ''.join(['%s %d\n' % (stack, int(round(weight * 1e6))) for stack, weight in sorted(stacks.iteritems())
+                        if weight >= 0.5e-6])
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name # built-ins
+    return '%s:%d(%s)' % (os.path.basename(filename), line, name)
+
+
+class ProfileResource(Resource):
+    # Mount somewhere only trusted clients can reach; formats are text, pstats, collapsed (microseconds) and the
+    # default JSON summary of every profiled resource
+    def __init__(self, profiler):
+        Resource.__init__(self)
+        self.profiler = profiler
+
+    def get(self, request, resource=None, format='text'):
+        if resource is None:
+            return self.profiler.summary()
+        if resource not in self.profiler.resources:
+            return HTTPNotFoundResponse()
+        if format == 'pstats':
+            return HTTPOkResponse(body=self.profiler.pstats_dump(resource), headers={
+                'Content-Type': 'application/octet-stream',
+                'Content-Disposition': 'attachment; filename="%s.pstats"' % resource,
+            })
+        if format == 'collapsed':
+            return HTTPOkResponse(body=self.profiler.collapsed(resource), headers={'Content-Type': 'text/plain'})
+        return HTTPOkResponse(body=self.profiler.text(resource), headers={'Content-Type': 'text/plain'})
+
+    def delete(self, request, resource=None):
+        self.profiler.reset(resource)
+        return self.profiler.summary()
@@ -1,13 +1,26 @@
 import datetime
 import email.utils
 import hashlib
+import httplib
 import json
 import mimetypes
+import mmap
 import os.path
+from   stat import S_ISDIR, S_ISLNK, S_ISREG
+import sys
+import tempfile
 import time
+import urllib
+import urlparse
 import uuid
-
-from vortex import SAFE_METHODS, HTTPStream, Resource, authenticate, http_date, signed_cookie, xsrf
+import weakref
+import zlib
+from   tornado.concurrent import Future, is_future
+from   tornado.escape import utf8
+from   tornado.ioloop import IOLoop
+
+from vortex import SAFE_METHODS, HTTPStream, Resource, authenticate, http_date, invalidate_resolution, json_dumps, negotiate_encoding, signed_cookie, xsrf
+from vortex.cache import _MISSING, LRUCache
 from vortex.responses import *
 
 class DictResource(Resource):
@@ -25,64 +38,316 @@ class DictResource(Resource):
 class MutableDictResource(DictResource):
     def __setitem__(self, name, value):
         self.sub_resources[name] = value
+        invalidate_resolution(self)
 
     def __delitem__(self, name):
         del self.sub_resources[name]
+        invalidate_resolution(self)
+
+
+class UploadStorage(object):
+    # Small bodies stay in memory, larger ones are spooled to temporary files; all of them count against the quota
+    def __init__(self, directory=None,
+                 spool_threshold=64*2**10,  # 64kB
+                 max_size=16*2**20,         # 16MB per upload
+                 quota=256*2**20):          # 256MB in total
+        self.directory = directory
+        self.spool_threshold = spool_threshold
+        self.max_size = max_size
+        self.quota = quota
+        self.used = 0
+
+    def too_large(self, size):
+        return self.max_size is not None and size > self.max_size
+
+    def fits(self, size, replacing=0):
+        return self.quota is None or self.used - replacing + size <= self.quota
+
+    def store(self, body):
+        # Returns (content, path); exactly one of them is set
+        self.used += len(body)
+        if len(body) <= self.spool_threshold:
+            return body, None
+        fd, path = tempfile.mkstemp(prefix='vortex-upload-', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(body)
+        except:
+            self.used -= len(body)
+            os.unlink(path)
+            raise
+        return None, path
+
+    def release(self, size, path=None):
+        self.used -= size
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
 
 
 class UploadResource(MutableDictResource):
     class ContentResource(Resource):
-        def __init__(self, uploader, name, content):
+        def __init__(self, uploader, name, content=None, path=None, size=0, content_type=None):
+            Resource.__init__(self)
             self.uploader = uploader
             self.name = name
             self.content = content
+            self.path = path
+            self.size = size
+            self.content_type = content_type
+            self._file = StaticFileResource(path, streaming=True, mimetype=content_type) if path is not None else None
 
         def get(self, request):
-            return self.content
+            if self._file is not None:
+                return self._file.get(request)
+            return HTTPOkResponse(self.content, headers={'Content-Type': self.content_type or 'application/octet-stream'})
 
         def put(self, request):
-            self.content = request.body
+            error = self.uploader.check(request, replacing=self.size)
+            if error is not None:
+                return error
+            replaced = self.size, self.path
+            self.content, self.path = self.uploader.storage.store(request.body)
+            self.size = len(request.body)
+            self.content_type = request.headers.get('Content-Type', None)
+            self._file = StaticFileResource(self.path, streaming=True, mimetype=self.content_type) if self.path is not None else None
+            self.uploader.storage.release(*replaced)
             return HTTPNoContentResponse()
 
         def delete(self, request):
             del self.uploader[self.name]
             return HTTPNoContentResponse()
 
+    def __init__(self, sub_resources=None, storage=None):
+        MutableDictResource.__init__(self, sub_resources)
+        self.storage = storage or UploadStorage()
+
+    def check(self, request, replacing=0):
+        # Tornado has already read the body by now, so its max_body_size is what bounds buffering;
+        # Content-Length still lets oversized uploads be turned away before anything is stored
+        try:
+            size = int(request.headers.get('Content-Length', len(request.body)))
+        except ValueError:
+            return HTTPBadRequestResponse()
+        size = max(size, len(request.body))
+        if self.storage.too_large(size):
+            return HTTPRequestEntityTooLargeResponse()
+        if not self.storage.fits(size, replacing):
+            return HTTPInsufficientStorageResponse()
+        return None
+
     def __getitem__(self, name):
         def put(request):
             if request.method != 'PUT':
                 return HTTPNotFoundResponse()
-            self[name] = self.ContentResource(self, name, request.body)
+            error = self.check(request)
+            if error is not None:
+                return error
+            content, path = self.storage.store(request.body)
+            self[name] = self.ContentResource(self, name, content, path, len(request.body), request.headers.get('Content-Type', None))
             return HTTPCreatedResponse()
 
         return self.sub_resources.get(name, put)
 
+    def __delitem__(self, name):
+        content = self.sub_resources[name]
+        MutableDictResource.__delitem__(self, name)
+        self.storage.release(content.size, content.path)
+
+
+_MAX_RANGES = 16
+
+
+def _parse_range(header, size):
+    # Returns None if the header should be ignored, or the (possibly empty) list of satisfiable inclusive ranges
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs:
+        return None
+    for spec in specs:
+        first, sep, last = spec.partition('-')
+        try:
+            if not sep:
+                return None
+            if not first:
+                length = int(last)
+                if length > 0 and size > 0:
+                    ranges.append((max(0, size - length), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1) if end is not None else size - 1))
+    if len(ranges) > _MAX_RANGES:
+        return None
+    return ranges
+
+
+class StaticFileCache(object):
+    class Entry(object):
+        def __init__(self, path, mtime, data, etag, gzip_data, gzip_etag, content_type, checked, validator):
+            self.path = path
+            self.mtime = mtime
+            self.data = data
+            self.etag = etag
+            self.last_modified = http_date(mtime)
+            self.gzip_data = gzip_data
+            self.gzip_etag = gzip_etag
+            self.content_type = content_type
+            self.checked = checked
+            self.validator = validator
+            self.size = len(data) + (len(gzip_data) if gzip_data is not None else 0)
+
+    def __init__(self, max_bytes=64*2**20,    # 64MB
+                 max_file_size=2**20,         # 1MB
+                 revalidate_interval=1.0,     # seconds
+                 compress_level=9, clock=time.time):
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+        self.compress_level = compress_level
+        self.clock = clock
+        self.entries = LRUCache(max_bytes=max_bytes, sizeof=lambda entry: entry.size)
+
+    def lookup(self, resource):
+        now = self.clock()
+        entry = self.entries.get(resource.path)
+        if entry is not None and now - entry.checked < self.revalidate_interval:
+            return entry
+
+        if not resource.os.path.isfile(resource.path):
+            self.entries.pop(resource.path)
+            return None
+        stat = resource.os.stat(resource.path)
+        gzip_stat = resource.precompressed_stat(stat.st_mtime)
+        validator = (stat.st_mtime, gzip_stat.st_mtime if gzip_stat is not None else None)
+        if entry is not None and entry.validator == validator:
+            entry.checked = now
+            return entry
+        if stat.st_size > self.max_file_size:
+            self.entries.pop(resource.path)
+            return None
+
+        data = self._read(resource, resource.path)
+        etag = resource.etag(stat.st_mtime)
+        if gzip_stat is not None:
+            gzip_data = self._read(resource, resource.path + '.gz')
+            gzip_etag = resource.etag(gzip_stat.st_mtime, resource.path + '.gz')
+        else:
+            # gzip framing: zlib with a window size offset by 16
+            compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+            gzip_data = compressor.compress(data) + compressor.flush()
+            if len(gzip_data) >= len(data):
+                gzip_data = None
+            gzip_etag = etag[:-1] + '-gzip"'
+        entry = self.Entry(resource.path, stat.st_mtime, data, etag, gzip_data, gzip_etag,
+                           resource.mimetype or mimetypes.guess_type(resource.path)[0], now, validator)
+        self.entries.set(resource.path, entry)
+        return entry
+
+    def _read(self, resource, path):
+        file = resource.open(path, 'rb')
+        try:
+            return file.read()
+        finally:
+            file.close()
+
+
+class _FileInfo(object):
+    __slots__ = ('size', 'mtime', 'etag', 'last_modified', 'mimetype', 'gzip')
+
+    def __init__(self, stat, etag, mimetype=None, gzip=None):
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = etag
+        self.last_modified = http_date(stat.st_mtime)
+        self.mimetype = mimetype
+        self.gzip = gzip # _FileInfo of the precompressed sibling
+
 
 class StaticFileResource(Resource):
     def __init__(self, path, os=os, open=open,
                  chunk_size=64*2**10,            # 64kB
-                 cache_max_age=60*60*24*365*10): # 10 years in seconds
+                 cache_max_age=60*60*24*365*10,  # 10 years in seconds
+                 streaming=False, cache=None, precompressed=False, mimetype=None):
         Resource.__init__(self)
         self.path = path
         self.os = os
         self.open = open
         self.chunk_size = chunk_size
         self.cache_max_age = cache_max_age
-
-    def get(self, request, **kwargs):
-        if not self.os.path.exists(self.path):
-            return HTTPNotFoundResponse()
+        self.streaming = streaming
+        self.cache = cache
+        self.precompressed = precompressed
+        self.mimetype = mimetype
+
+    def etag(self, modified, path=None):
+        return '"%s"' % hashlib.sha1('\0'.join([path or self.path, str(modified)])).hexdigest()
+
+    def precompressed_stat(self, modified):
+        # A .gz sibling is only trusted if it is at least as new as the file it was built from
+        if not self.precompressed or not self.os.path.isfile(self.path + '.gz'):
+            return None
+        stat = self.os.stat(self.path + '.gz')
+        return stat if stat.st_mtime >= modified else None
+
+    def _stat(self):
         if not self.os.path.isfile(self.path):
-            return HTTPMethodNotAllowedResponse(allowed=[])
+            return None
+        stat = self.os.stat(self.path)
+        gzip_stat = self.precompressed_stat(stat.st_mtime)
+        return _FileInfo(stat, self.etag(stat.st_mtime), self.mimetype or mimetypes.guess_type(self.path)[0],
+                         _FileInfo(gzip_stat, self.etag(gzip_stat.st_mtime, self.path + '.gz')) if gzip_stat is not None else None)
 
-        # Don't send the result if the content has not been modified since the If-Modified-Since
-        modified = self.os.stat(self.path).st_mtime
+    def get(self, request, **kwargs):
+        entry = self.cache.lookup(self) if self.cache is not None else None
+        if entry is not None:
+            modified = entry.mtime
+            size = len(entry.data)
+            etag = entry.etag
+            last_modified = entry.last_modified
+            mimetype = entry.content_type
+            compressible = entry.gzip_data is not None
+        else:
+            info = self._stat()
+            if info is None:
+                if self.os.path.isdir(self.path):
+                    return HTTPMethodNotAllowedResponse(allowed=[])
+                return HTTPNotFoundResponse()
+            modified = info.mtime
+            size = info.size
+            etag = info.etag
+            last_modified = info.last_modified
+            mimetype = info.mimetype
+            compressible = info.gzip is not None
+
+        # Pick the representation first, since its validators are the ones the conditional headers are checked against.
+        # Ranges always address the identity representation.
+        gzipped = compressible and 'Range' not in request.headers and \
+                  negotiate_encoding(request.headers.get('Accept-Encoding', ''), ('gzip',)) is not None
+        if gzipped:
+            if entry is not None:
+                size = len(entry.gzip_data)
+                etag = entry.gzip_etag
+            else:
+                modified = info.gzip.mtime
+                size = info.gzip.size
+                etag = info.gzip.etag
+                last_modified = info.gzip.last_modified
 
         headers = {
-            'Etag': '"%s"' % hashlib.sha1('\0'.join([self.path, str(modified)])).hexdigest(),
-            'Last-Modified': http_date(modified),
+            'Etag': etag,
+            'Last-Modified': last_modified,
         }
+        if compressible:
+            headers['Vary'] = 'Accept-Encoding'
 
+        # Don't send the result if the content has not been modified since the If-Modified-Since
         if 'If-Modified-Since' in request.headers and time.mktime(email.utils.parsedate(request.headers['If-Modified-Since'])) >= modified:
             return HTTPNotModifiedResponse(headers=headers)
 
@@ -93,7 +358,6 @@ class StaticFileResource(Resource):
             elif inm.find(headers['Etag']) != -1 or inm == '*':
                 return HTTPNotModifiedResponse(headers=headers)
 
-        mimetype = mimetypes.guess_type(self.path)[0]
         if mimetype:
             headers['Content-Type'] = mimetype
 
@@ -102,40 +366,497 @@ class StaticFileResource(Resource):
             headers['Expires'] = http_date(time.mktime((datetime.datetime.utcnow() + datetime.timedelta(seconds=cache_time)).timetuple()))
             headers['Cache-Control'] = 'max-age=' + str(cache_time)
 
+        headers['Accept-Ranges'] = 'bytes'
+        if 'Range' in request.headers:
+            if_range = request.headers.get('If-Range', None)
+            if if_range is None or if_range == headers['Etag'] or if_range == headers['Last-Modified']:
+                ranges = _parse_range(request.headers['Range'], size)
+                if ranges is not None:
+                    if len(ranges) == 0:
+                        return HTTPRequestedRangeNotSatisfiableResponse(headers={'Content-Range': 'bytes */%d' % size})
+                    return self._send_ranges(request, entry, HTTPPartialContentResponse(headers=headers).preamble, ranges, size)
+
+        headers['Content-Length'] = str(size)
+        if gzipped:
+            headers['Content-Encoding'] = 'gzip'
         response = HTTPPreamble(headers=headers)
 
+        if entry is not None or gzipped:
+            # The body is already encoded, so bypass the stream's encoders
+            stream = HTTPStream(request, response, encoders=[])
+            if request.method == 'HEAD':
+                stream.finish()
+            elif entry is not None:
+                stream.finish(entry.gzip_data if gzipped else entry.data)
+            else:
+                source = self._open(self.path + '.gz')
+                self._send(stream, self._chunks(source, 0, size), source)
+            return
+
         if request.method == 'HEAD':
-            return response
+            return HTTPResponse(response)
 
+        # Content-Length is replaced by chunked framing if an encoder compresses the body
         stream = HTTPStream(request, response)
-        file = self.open(self.path, 'rb')
+        source = self._open()
+        self._send(stream, self._chunks(source, 0, size), source)
+
+    def _send_ranges(self, request, entry, response, ranges, size):
+        headers = response.headers
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+            length = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            part_type = 'Content-Type: %s\r\n' % headers['Content-Type'] if 'Content-Type' in headers else ''
+            parts = [('\r\n--%s\r\n%sContent-Range: bytes %d-%d/%d\r\n\r\n' % (boundary, part_type, start, end, size), start, end) for start, end in ranges]
+            closing = '\r\n--%s--\r\n' % boundary
+            length = sum([len(part) + end - start + 1 for part, start, end in parts]) + len(closing)
+            headers['Content-Type'] = 'multipart/byteranges; boundary=' + boundary
+        headers['Content-Length'] = str(length)
+
+        # Ranges address the identity representation, so they are never compressed
+        stream = HTTPStream(request, response, encoders=[])
+        if request.method == 'HEAD':
+            stream.finish()
+            return
+
+        source = entry.data if entry is not None else self._open()
+        if len(ranges) == 1:
+            chunks = self._chunks(source, start, end + 1)
+        else:
+            def multipart():
+                for part, start, end in parts:
+                    yield part
+                    for chunk in self._chunks(source, start, end + 1):
+                        yield chunk
+                yield closing
+            chunks = multipart()
+        self._send(stream, chunks, source)
+
+    def _open(self, path=None):
+        # Memory-map the file when possible so that slices are taken without an intermediate read buffer
+        file = self.open(path or self.path, 'rb')
         try:
-            while True:
-                chunk = file.read(self.chunk_size)
-                if len(chunk) == 0:
-                    break
-                stream.write(chunk)
-        finally:
-            file.close()
-
-        stream.finish()
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError): # file-like objects without a descriptor, empty files
+            return file
+        file.close()
+        return data
+
+    def _chunks(self, source, start, end):
+        sliceable = isinstance(source, (str, mmap.mmap))
+        if not sliceable:
+            source.seek(start)
+        while start < end:
+            length = min(self.chunk_size, end - start)
+            chunk = source[start:start+length] if sliceable else source.read(length)
+            if len(chunk) == 0:
+                break
+            start += len(chunk)
+            yield chunk
+
+    def _send(self, stream, chunks, source):
+        close = getattr(source, 'close', lambda: None)
+        if not self.streaming:
+            try:
+                for chunk in chunks:
+                    stream.write(chunk)
+            finally:
+                close()
+            stream.finish()
+            return
+
+        # Write one chunk at a time, producing the next only once the previous one has drained to the socket
+        def next_chunk():
+            try:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    stream.flush(chunk, next_chunk)
+                    return
+            except:
+                close()
+                raise
+            close()
+            stream.finish()
+        next_chunk()
+
+    def resolution_ttl(self, name):
+        # Children of a directory are found again however long they're cached, but one that doesn't exist yet may
+        # be created at any time, so misses aren't cached at all
+        return None if self.os.path.isdir(self.path) else 0
 
     def __getitem__(self, name):
         if not self.os.path.isdir(self.path):
             raise KeyError()
-        return self.__class__(self.os.path.join(self.path, name))
+        return self.__class__(self.os.path.join(self.path, name), os=self.os, open=self.open, chunk_size=self.chunk_size,
+                              cache_max_age=self.cache_max_age, streaming=self.streaming, cache=self.cache,
+                              precompressed=self.precompressed)
+
+
+class _IndexedFile(StaticFileResource):
+    # A file node in a StaticDirectoryResource index, serving from the stat taken when the index was refreshed
+    def __init__(self, path, stat, gzip_stat, validator, **kwargs):
+        StaticFileResource.__init__(self, path, **kwargs)
+        self.info = _FileInfo(stat, self.etag(stat.st_mtime), mimetypes.guess_type(path)[0],
+                              _FileInfo(gzip_stat, self.etag(gzip_stat.st_mtime, path + '.gz')) if gzip_stat is not None else None)
+        self.validator = validator
+
+    def _stat(self):
+        return self.info
+
+    def __getitem__(self, name):
+        raise KeyError(name)
+
+
+class _IndexedDirectory(Resource):
+    def __init__(self, path, index):
+        Resource.__init__(self)
+        self.path = path
+        self.index = index
+        self.children = {}
+        self.names = ()
+        self.mtime = None
+
+    def __getitem__(self, name):
+        if name == '' and self.index is not None: # trailing slash
+            return self.children[self.index]
+        return self.children[name]
+
+    def get(self, request, **kwargs):
+        if self.index is None or self.index not in self.children:
+            return HTTPNotFoundResponse()
+        return HTTPFoundResponse(request.path + '/')
+
+
+class StaticDirectoryResource(Resource):
+    # Files are looked up in an index of prebuilt nodes holding their stat, content type and ETag, so serving one
+    # makes no syscalls to find it. The tree is rescanned every refresh_interval seconds, on the next request;
+    # only files whose mtime, size or precompressed sibling changed get new nodes. Symlinks leading outside the
+    # root or back up to one of their own parent directories are left out, and since paths are only ever looked up
+    # in the index, nothing outside it can be reached.
+    def __init__(self, path, index='index.html', refresh_interval=2.0, os=os, open=open,
+                 chunk_size=64*2**10,            # 64kB
+                 cache_max_age=60*60*24*365*10,  # 10 years in seconds
+                 streaming=False, cache=None, precompressed=False, clock=time.time):
+        Resource.__init__(self)
+        self.path = path
+        self.index = index
+        self.refresh_interval = refresh_interval
+        self.os = os
+        self.clock = clock
+        self.file_settings = dict(os=os, open=open, chunk_size=chunk_size, cache_max_age=cache_max_age,
+                                  streaming=streaming, cache=cache, precompressed=precompressed)
+        self._root = _IndexedDirectory(path, index)
+        self._real_root = None
+        self._refreshed = None
+
+    def _current(self):
+        now = self.clock()
+        if self._refreshed is None or now - self._refreshed >= self.refresh_interval:
+            self._refreshed = now
+            self._real_root = self.os.path.realpath(self.path)
+            if self._scan(self._root):
+                invalidate_resolution(self)
+        return self._root
+
+    def refresh(self):
+        self._refreshed = None
+        self._current()
+
+    def resolution_ttl(self, name):
+        # Resolved paths must not outlive the index they were found in
+        return self.refresh_interval - (self.clock() - self._refreshed) if self._refreshed is not None else 0
+
+    def __getitem__(self, name):
+        return self._current()[name]
+
+    def get(self, request, **kwargs):
+        return self._current().get(request, **kwargs)
+
+    def _scan(self, directory, ancestors=()):
+        # Returns whether anything under directory changed
+        try:
+            stat = self.os.stat(directory.path)
+            mtime = stat.st_mtime
+            if mtime != directory.mtime:
+                directory.mtime = mtime
+                directory.names = self.os.listdir(directory.path)
+        except OSError:
+            changed = bool(directory.children)
+            directory.children.clear()
+            directory.mtime = None
+            return changed
+
+        ancestors += ((stat.st_dev, stat.st_ino),)
+        stats = {}
+        for name in directory.names:
+            path = self.os.path.join(directory.path, name)
+            try:
+                stat = self.os.lstat(path)
+                if S_ISLNK(stat.st_mode):
+                    real = self.os.path.realpath(path)
+                    if real != self._real_root and not real.startswith(self._real_root + self.os.sep):
+                        continue
+                    stat = self.os.stat(path)
+            except OSError:
+                continue
+            stats[name] = stat
+
+        changed = False
+        for name in list(directory.children):
+            if name not in stats:
+                del directory.children[name]
+                changed = True
+        for name, stat in stats.iteritems():
+            child = directory.children.get(name)
+            path = self.os.path.join(directory.path, name)
+            if S_ISDIR(stat.st_mode) and (stat.st_dev, stat.st_ino) in ancestors:
+                # A symlink back up the tree, which would otherwise be followed until the path is too long
+                if child is not None:
+                    del directory.children[name]
+                    changed = True
+            elif S_ISDIR(stat.st_mode):
+                if not isinstance(child, _IndexedDirectory):
+                    child = directory.children[name] = _IndexedDirectory(path, self.index)
+                    changed = True
+                changed = self._scan(child, ancestors) or changed
+            elif S_ISREG(stat.st_mode):
+                gzip_stat = stats.get(name + '.gz') if self.file_settings['precompressed'] else None
+                if gzip_stat is not None and (not S_ISREG(gzip_stat.st_mode) or gzip_stat.st_mtime < stat.st_mtime):
+                    gzip_stat = None
+                validator = (stat.st_mtime, stat.st_size, gzip_stat.st_mtime if gzip_stat is not None else None)
+                if isinstance(child, _IndexedFile) and child.validator == validator:
+                    continue
+                directory.children[name] = _IndexedFile(path, stat, gzip_stat, validator, **self.file_settings)
+                changed = True
+            elif child is not None:
+                del directory.children[name]
+                changed = True
+        return changed
 
 
 class JSONResource(DictResource):
+    def __init__(self, sub_resources=None, parent=None):
+        DictResource.__init__(self)
+        self.sub_resources = sub_resources if sub_resources is not None else {}
+        self.parent = parent
+        self._children = {}
+        self._serialized = None # (body, etag), until this subtree is mutated
+
+    def _key(self, name):
+        if isinstance(self.sub_resources, list):
+            try:
+                index = int(name)
+            except ValueError:
+                raise KeyError(name)
+            # One wrapper per element, however the index is spelled
+            if index < 0:
+                index += len(self.sub_resources)
+                if index < 0:
+                    raise KeyError(name)
+            return index
+        if not isinstance(self.sub_resources, dict):
+            raise KeyError(name)
+        return name
+
     def __getitem__(self, name):
-        return JSONResource(DictResource.__getitem__(self, name if not isinstance(self.sub_resources, list) else int(name)))
+        # Wrappers are kept so that traversal doesn't allocate, and so mutations can reach the memoized ancestors
+        key = self._key(name)
+        child = self._children.get(key)
+        if child is None:
+            try:
+                value = self.sub_resources[key]
+            except IndexError:
+                raise KeyError(name)
+            child = self._children[key] = JSONResource(value, self)
+        return child
+
+    def __setitem__(self, name, value):
+        key = self._key(name)
+        try:
+            self.sub_resources[key] = value
+        except IndexError:
+            raise KeyError(name)
+        self.invalidate()
+
+    def __delitem__(self, name):
+        try:
+            del self.sub_resources[self._key(name)]
+        except IndexError:
+            raise KeyError(name)
+        self.invalidate()
+
+    def invalidate(self):
+        # Call after mutating sub_resources directly. Any child may have been replaced, or moved by a list insert or
+        # delete, so none of the wrappers below this one can be trusted.
+        self._children.clear()
+        resource = self
+        while resource is not None:
+            resource._serialized = None
+            invalidate_resolution(resource)
+            resource = resource.parent
+
+    def serialized(self):
+        if self._serialized is None:
+            body = json_dumps(self.sub_resources)
+            self._serialized = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+        return self._serialized
 
     def get(self, request, callback=None):
-        response = HTTPOkResponse(body=json.dumps(self.sub_resources))
+        body, etag = self.serialized()
         if callback is not None:
-            response.body = callback+'('+response.entity+');'
-            response.preamble.headers['Content-Type'] = 'application/json-p'
-        return response
+            return HTTPOkResponse(body=callback+'('+body+');', headers={'Content-Type': 'application/json-p'})
+        inm = request.headers.get('If-None-Match', None)
+        if inm and (inm.find(etag) != -1 or inm == '*'):
+            return HTTPNotModifiedResponse(headers={'Etag': etag})
+        return HTTPOkResponse(body=body, headers={'Content-Type': 'application/json', 'Etag': etag})
+
+
+def _dechunk(data):
+    chunks = []
+    while True:
+        size, _, data = data.partition('\r\n')
+        size = int(size.split(';', 1)[0], 16)
+        if size == 0:
+            return ''.join(chunks)
+        chunks.append(data[:size])
+        data = data[size+2:]
+
+
+class _BatchItemRequest(object):
+    # Stands in for the HTTP request while one item of a batch is dispatched, capturing what it writes
+    _dropped_headers = ('Accept-Encoding', 'Content-Length', 'Content-Type', 'Range', 'If-Range')
+
+    def __init__(self, request, method, path, arguments, body, on_finish):
+        self.method = method
+        self.path, _, self.query = path.partition('?')
+        self.arguments = urlparse.parse_qs(self.query)
+        for name, values in arguments.iteritems():
+            self.arguments.setdefault(name, []).extend(values)
+        self.query = urllib.urlencode([(name, value) for name, values in self.arguments.iteritems() for value in values])
+        self.uri = self.path + ('?' + self.query if self.query else '')
+        self.headers = request.headers.copy()
+        for name in self._dropped_headers:
+            self.headers.pop(name, None)
+        self.body = body
+        self.files = {}
+        self.version = request.version
+        self.remote_ip = request.remote_ip
+        self.host = request.host
+        self.protocol = getattr(request, 'protocol', 'http')
+        self.cookies = request.cookies
+        self.vortex_batch = True
+        self._writes = []
+        self._on_finish = on_finish
+
+    def write(self, data, callback=None):
+        self._writes.append(data)
+        if callback is not None:
+            IOLoop.current().add_callback(callback)
+
+    def finish(self):
+        # The first write is always the preamble
+        head = self._writes[0].split('\r\n') if self._writes else ['HTTP/1.1 500 Internal Server Error']
+        headers = {}
+        for line in head[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name] = value.strip()
+        body = ''.join(self._writes[1:])
+        if headers.pop('Transfer-Encoding', None) == 'chunked':
+            body = _dechunk(body)
+        for name in ('Content-Length', 'Date', 'Vary'):
+            headers.pop(name, None)
+        self._on_finish(int(head[0].split(' ', 2)[1]), headers, body)
+
+    def __str__(self):
+        return '%s %s (batched)' % (self.method, self.uri)
+
+
+class BatchResource(Resource):
+    # POST a JSON list of [method, path, args] or {"method", "path", "args", "body"} items to dispatch each through
+    # the application in-process. Results are streamed back as a JSON array in completion order, each one an
+    # object with the item's index, status, headers and body; JSON bodies are embedded as they are.
+    def __init__(self, application, max_items=50, timeout=30):
+        Resource.__init__(self)
+        self.application = application
+        self.max_items = max_items
+        self.timeout = timeout
+
+    def _parse(self, item):
+        if isinstance(item, dict):
+            method, path, args, body = item.get('method', 'GET'), item.get('path'), item.get('args', {}), item.get('body', '')
+        elif isinstance(item, list) and 2 <= len(item) <= 3:
+            method, path, args, body = item[0], item[1], item[2] if len(item) == 3 else {}, ''
+        else:
+            raise ValueError('Items are [method, path, args] lists or objects')
+        if not isinstance(method, basestring) or not isinstance(path, basestring) or not path.startswith('/'):
+            raise ValueError('Items need a method and an absolute path')
+        if not isinstance(args, dict) or not isinstance(body, basestring):
+            raise ValueError('Item args must be an object and body a string')
+        arguments = {}
+        for name, values in args.iteritems():
+            arguments[utf8(name)] = [utf8(unicode(value)) for value in (values if isinstance(values, list) else [values])]
+        return utf8(method.upper()), utf8(path), arguments, utf8(body)
+
+    def post(self, request, **kwargs):
+        # The batch is read from the body whatever its Content-Type, so arguments tornado parsed out of a
+        # form-encoded one are ignored
+        if getattr(request, 'vortex_batch', False):
+            return HTTPBadRequestResponse(body='Batches cannot be nested')
+        try:
+            items = json.loads(request.body)
+        except ValueError:
+            return HTTPBadRequestResponse(body='Body must be a JSON list')
+        if not isinstance(items, list):
+            return HTTPBadRequestResponse(body='Body must be a JSON list')
+        if len(items) > self.max_items:
+            return HTTPRequestEntityTooLargeResponse(body='At most %d items per batch' % self.max_items)
+
+        stream = HTTPStream(request, HTTPPreamble(headers={'Content-Type': 'application/json'}), self.application.encoders)
+        if not items:
+            stream.finish('[]')
+            return stream
+        state = {'separator': '[', 'timeout': None}
+        done = set()
+
+        def completed(index, status, headers, body):
+            if index in done: # answered with a timeout already
+                return
+            done.add(index)
+            if headers.get('Content-Type', '').split(';', 1)[0].strip() == 'application/json' and body:
+                body = body.strip()
+            else:
+                body = json_dumps(body.decode('utf-8', 'replace'))
+            result = '%s{"index": %d, "status": %d, "headers": %s, "body": %s}' % (state['separator'], index, status, json_dumps(headers), body)
+            state['separator'] = ', '
+            if len(done) < len(items):
+                stream.flush(result)
+                return
+            if state['timeout'] is not None:
+                IOLoop.current().remove_timeout(state['timeout'])
+            stream.finish(result + ']')
+
+        def timed_out():
+            for index in range(len(items)):
+                if index not in done:
+                    completed(index, httplib.GATEWAY_TIMEOUT, {}, '')
+
+        if self.timeout:
+            state['timeout'] = IOLoop.current().call_later(self.timeout, timed_out)
+
+        # Synchronous items complete as they are dispatched; asynchronous ones run concurrently and finish later
+        for index, item in enumerate(items):
+            try:
+                method, path, arguments, body = self._parse(item)
+            except ValueError as err:
+                completed(index, httplib.BAD_REQUEST, {}, str(err))
+                continue
+            on_finish = lambda status, headers, body, index=index: completed(index, status, headers, body)
+            self.application.handle(_BatchItemRequest(request, method, path, arguments, body, on_finish))
+        return stream
 
 
 class TraceResource(Resource):
@@ -144,12 +865,61 @@ class TraceResource(Resource):
 
 
 class LazyDictResource(DictResource):
-    def __init__(self, lazy_resources=None):
+    # Factories may return a Future; concurrent lookups of a key that is still being built share it.
+    # With weak=True, evicted resources still referenced elsewhere are reused instead of rebuilt.
+    def __init__(self, lazy_resources=None, ttl=None, max_entries=None, weak=False, clock=time.time):
+        DictResource.__init__(self)
         self.lazy_resources = lazy_resources or {}
+        self.sub_resources = LRUCache(max_entries=max_entries, ttl=ttl, on_evict=self._evicted, clock=clock)
+        self._weak = weakref.WeakValueDictionary() if weak else None
+        self._pending = {}
 
     def __getitem__(self, name):
-        if name not in self.sub_resources:
-            value = self.lazy_resources[name]()
-            self.sub_resources[name] = value
+        value = self.sub_resources.get(name, _MISSING)
+        if value is not _MISSING:
             return value
-        return DictResource.__getitem__(self, name)
+        pending = self._pending.get(name)
+        if pending is not None:
+            return pending
+        value = self._weak.get(name) if self._weak is not None else None
+        if value is None:
+            value = self.lazy_resources[name]()
+            if is_future(value):
+                return self._building(name, value)
+        self._built(name, value)
+        return value
+
+    def _building(self, name, future):
+        built = self._pending[name] = Future()
+        def done(future):
+            del self._pending[name]
+            try:
+                value = future.result()
+            except:
+                built.set_exc_info(sys.exc_info())
+                return
+            self._built(name, value)
+            built.set_result(value)
+        IOLoop.current().add_future(future, done)
+        return built
+
+    def _built(self, name, value):
+        self.sub_resources.set(name, value)
+        if self._weak is not None:
+            self._weak[name] = value
+
+    def resolution_ttl(self, name):
+        expires = self.sub_resources.expires(name)
+        return expires - self.sub_resources.clock() if expires is not None else None
+
+    def __contains__(self, name):
+        return name in self.lazy_resources
+
+    def __delitem__(self, name):
+        # Forget the constructed resource; the factory runs again on next access
+        if self._weak is not None:
+            self._weak.pop(name, None)
+        del self.sub_resources[name]
+
+    def _evicted(self, name, value):
+        invalidate_resolution(self)
@@ -2,56 +2,134 @@ import httplib
 
 from vortex import HTTPPreamble, HTTPResponse
 
+class HTTPOkResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.OK, **kwargs), body=body)
+
+
 class HTTPCreatedResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.CREATED, **kwargs))
 
 
 class HTTPNoContentResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.NO_CONTENT, **kwargs))
 
 
+class HTTPPartialContentResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.PARTIAL_CONTENT, **kwargs), body=body)
+
+
 class HTTPFoundResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, location, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.FOUND, headers={'Location': location}, **kwargs), body=body)
 
 
 class HTTPNotModifiedResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.NOT_MODIFIED, **kwargs), body=body)
 
 
 class HTTPNotFoundResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.NOT_FOUND, **kwargs), body=body)
 
 
 class HTTPBadRequestResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.BAD_REQUEST, **kwargs), body=body)
 
 
 class HTTPUnauthorizedResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.UNAUTHORIZED, **kwargs), body=body)
 
 
 class HTTPForbiddenResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.FORBIDDEN, **kwargs), body=body)
 
 
 class HTTPMethodNotAllowedResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, allowed, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.METHOD_NOT_ALLOWED, headers={'Allowed': allowed}, **kwargs), body=body)
 
 
+class HTTPPreconditionFailedResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.PRECONDITION_FAILED, **kwargs), body=body)
+
+
+class HTTPRequestEntityTooLargeResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.REQUEST_ENTITY_TOO_LARGE, **kwargs), body=body)
+
+
+class HTTPRequestedRangeNotSatisfiableResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.REQUESTED_RANGE_NOT_SATISFIABLE, **kwargs), body=body)
+
+
+class HTTPTooManyRequestsResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=429, reason='Too Many Requests', **kwargs), body=body)
+
+
 class HTTPNotImplementedResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.NOT_IMPLEMENTED, **kwargs), body=body)
 
 
 class HTTPInternalServerErrorResponse(HTTPResponse):
+    __slots__ = ()
+
     def __init__(self, body='', **kwargs):
         HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.INTERNAL_SERVER_ERROR, **kwargs), body=body)
+
+
+class HTTPServiceUnavailableResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.SERVICE_UNAVAILABLE, **kwargs), body=body)
+
+
+class HTTPInsufficientStorageResponse(HTTPResponse):
+    __slots__ = ()
+
+    def __init__(self, body='', **kwargs):
+        HTTPResponse.__init__(self, HTTPPreamble(status_code=httplib.INSUFFICIENT_STORAGE, reason='Insufficient Storage', **kwargs), body=body)
@@ -0,0 +1,330 @@
+import argparse
+import errno
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import select
+import signal
+import sys
+import time
+from   tornado.httpserver import HTTPServer
+from   tornado.ioloop import IOLoop, PeriodicCallback
+from   tornado.netutil import bind_sockets
+
+logger = logging.getLogger('vortex.server')
+
+
+def load_application(spec):
+    module_name, _, attr = spec.partition(':')
+    application = importlib.import_module(module_name)
+    for name in (attr or 'application').split('.'):
+        application = getattr(application, name)
+    return application
+
+
+class _CountingApplication(object):
+    def __init__(self, application):
+        self.application = application
+        self.requests = 0
+
+    def __call__(self, request):
+        self.requests += 1
+        return self.application(request)
+
+
+class Worker(object):
+    def __init__(self, application, sockets, pipe, drain_timeout=10, report_interval=5, counters=None, server_kwargs=None):
+        self.application = _CountingApplication(application)
+        self.sockets = sockets
+        self.pipe = pipe
+        self.drain_timeout = drain_timeout
+        self.report_interval = report_interval
+        self.counters = counters
+        self.server_kwargs = server_kwargs or {}
+        self.started = time.time()
+
+    def run(self):
+        self.io_loop = IOLoop.current()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.io_loop.add_callback_from_signal(self.drain))
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # the supervisor decides when workers stop
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.server = HTTPServer(self.application, **self.server_kwargs)
+        self.server.add_sockets(self.sockets)
+        PeriodicCallback(self.report, self.report_interval * 1000).start()
+        self.io_loop.start()
+        self.report()
+
+    def drain(self):
+        # Stop accepting, then give open connections until drain_timeout to finish
+        self.server.stop()
+        deadline = time.time() + self.drain_timeout
+        def check():
+            if not getattr(self.server, '_connections', None) or time.time() >= deadline:
+                self.io_loop.stop()
+            else:
+                self.io_loop.call_later(0.1, check)
+        check()
+
+    def report(self):
+        counters = {
+            'pid': os.getpid(),
+            'requests': self.application.requests,
+            'uptime': time.time() - self.started,
+        }
+        if self.counters is not None:
+            counters.update(self.counters())
+        try:
+            os.write(self.pipe, json.dumps(counters) + '\n')
+        except OSError: # the supervisor has gone away
+            pass
+
+
+class Supervisor(object):
+    # application is either the application itself or a 'module:attribute' spec, which every worker imports after
+    # it's forked. Only with a spec does a reload on SIGHUP pick up new code and configuration; otherwise workers
+    # are forked from the supervisor's own copy, and reloading is just a rolling restart.
+    def __init__(self, application, port, address='', processes=None, drain_timeout=10, report_interval=5,
+                 status_file=None, counters=None, server_kwargs=None, min_uptime=1.0):
+        self.application = application
+        self.port = port
+        self.address = address
+        self.processes = processes or multiprocessing.cpu_count()
+        self.drain_timeout = drain_timeout
+        self.report_interval = report_interval
+        self.status_file = status_file
+        self.counters = counters
+        self.server_kwargs = server_kwargs
+        self.min_uptime = min_uptime
+        self.workers = {} # pid -> (pipe, spawned)
+        self.worker_counters = {}
+        self.totals = {}
+        self._buffers = {}
+        self._stopping = False
+        self._reloading = []
+        self._replacing = None # (old pid, replacement pid)
+        self._retiring = None
+        self._respawn_at = []
+
+    def run(self):
+        self.sockets = bind_sockets(self.port, self.address)
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        for i in range(self.processes):
+            self._spawn()
+
+        stop_deadline = None
+        last_report = time.time()
+        while self.workers or (self._respawn_at and not self._stopping):
+            self._read_counters()
+            self._reap()
+            now = time.time()
+
+            if self._stopping:
+                if stop_deadline is None:
+                    stop_deadline = now + self.drain_timeout + 1
+                    self._signal_all(signal.SIGTERM)
+                elif now >= stop_deadline:
+                    self._signal_all(signal.SIGKILL)
+                continue
+
+            for respawn_at in [t for t in self._respawn_at if t <= now]:
+                self._respawn_at.remove(respawn_at)
+                self._spawn()
+            if self._retiring is None and self._replacing is None and self._reloading:
+                # Start a replacement before draining the old worker, so capacity never drops
+                old = self._reloading.pop(0)
+                if old in self.workers:
+                    self._replacing = (old, self._spawn())
+            if self._replacing is not None:
+                old, new = self._replacing
+                # ...and only once the replacement has stayed up, so a reload into broken code leaves the old workers
+                # serving
+                if now - self.workers[new][1] >= self.min_uptime:
+                    self._replacing = None
+                    self._retiring = old
+                    os.kill(old, signal.SIGTERM)
+
+            if now - last_report >= self.report_interval:
+                self._report(now - last_report)
+                last_report = now
+
+        for sock in self.sockets:
+            sock.close()
+
+    def _spawn(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for fd, _ in self.workers.values():
+                os.close(fd)
+            status = 0
+            try:
+                application = self.application
+                if isinstance(application, basestring):
+                    application = load_application(application)
+                Worker(application, self.sockets, write_fd, self.drain_timeout, self.report_interval,
+                       self.counters, self.server_kwargs).run()
+            except:
+                logger.exception('Worker %d failed', os.getpid())
+                status = 1
+            os._exit(status)
+        os.close(write_fd)
+        self.workers[pid] = (read_fd, time.time())
+        self._buffers[read_fd] = ''
+        logger.info('Started worker %d', pid)
+        return pid
+
+    def _read_counters(self):
+        fds = [fd for fd, _ in self.workers.values()]
+        try:
+            readable = select.select(fds, [], [], 0.5)[0]
+        except (select.error, OSError) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            return
+        for fd in readable:
+            data = os.read(fd, 65536)
+            lines = (self._buffers.get(fd, '') + data).split('\n')
+            self._buffers[fd] = lines.pop()
+            for line in lines:
+                try:
+                    counters = json.loads(line)
+                except ValueError:
+                    continue
+                self.worker_counters[counters['pid']] = counters
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno == errno.ECHILD:
+                    self.workers.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            fd, spawned = self.workers.pop(pid, (None, None))
+            if fd is None:
+                continue
+            self._read_remaining(fd)
+            os.close(fd)
+            del self._buffers[fd]
+            if self._replacing is not None and pid in self._replacing:
+                old, new = self._replacing
+                self._replacing = None
+                if pid == new:
+                    logger.error('Replacement worker %d exited, abandoning the reload', pid)
+                    self._reloading = []
+                else: # the replacement takes its place
+                    logger.warning('Worker %d exited while being replaced', pid)
+            elif pid == self._retiring:
+                logger.info('Worker %d retired', pid)
+                self._retiring = None
+            elif not self._stopping:
+                if os.WIFSIGNALED(status):
+                    logger.warning('Worker %d killed by signal %d, restarting', pid, os.WTERMSIG(status))
+                else:
+                    logger.warning('Worker %d exited with status %d, restarting', pid, os.WEXITSTATUS(status))
+                # Back off instead of fork-looping when workers crash on startup
+                self._respawn_at.append(time.time() + (1 if time.time() - spawned < self.min_uptime else 0))
+            self._retire_counters(pid)
+
+    def _read_remaining(self, fd):
+        try:
+            while select.select([fd], [], [], 0)[0]:
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                for line in (self._buffers[fd] + data).split('\n')[:-1]:
+                    try:
+                        counters = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.worker_counters[counters['pid']] = counters
+                self._buffers[fd] = ''
+        except (select.error, OSError):
+            pass
+
+    def _retire_counters(self, pid):
+        # Fold the final counters of exited workers into the totals so they don't go backwards
+        counters = self.worker_counters.pop(pid, {})
+        for key, value in counters.items():
+            if key not in ('pid', 'uptime') and isinstance(value, (int, long, float)):
+                self.totals[key] = self.totals.get(key, 0) + value
+
+    def aggregate(self):
+        totals = dict(self.totals)
+        for counters in self.worker_counters.values():
+            for key, value in counters.items():
+                if key not in ('pid', 'uptime') and isinstance(value, (int, long, float)):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _report(self, interval):
+        totals = self.aggregate()
+        previous = getattr(self, '_previous_requests', totals.get('requests', 0))
+        self._previous_requests = totals.get('requests', 0)
+        status = {
+            'workers': len(self.workers),
+            'totals': totals,
+            'requests_per_second': (totals.get('requests', 0) - previous) / interval,
+            'per_worker': self.worker_counters.values(),
+        }
+        logger.info('%d workers, %d requests, %.1f req/s', status['workers'], totals.get('requests', 0), status['requests_per_second'])
+        if self.status_file:
+            temp = self.status_file + '.tmp'
+            with open(temp, 'w') as file:
+                json.dump(status, file)
+            os.rename(temp, self.status_file)
+
+    def _signal_all(self, signum):
+        for pid in self.workers.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _reload(self, signum, frame):
+        self._reloading.extend([pid for pid in self.workers if pid not in self._reloading])
+
+
+def serve(application, port, address='', processes=None, **kwargs):
+    if processes == 1 or not hasattr(os, 'fork'):
+        if isinstance(application, basestring):
+            application = load_application(application)
+        HTTPServer(application, **kwargs.get('server_kwargs', None) or {}).listen(port, address)
+        IOLoop.current().start()
+    else:
+        Supervisor(application, port, address, processes, **kwargs).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a vortex Application from pre-forked worker processes')
+    parser.add_argument('application', help='module:attribute of the Application to serve')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--address', default='')
+    parser.add_argument('--processes', type=int, default=0, help='number of workers; 0 means one per CPU')
+    parser.add_argument('--drain-timeout', type=float, default=10, help='seconds workers get to finish open requests')
+    parser.add_argument('--report-interval', type=float, default=5, help='seconds between counter reports')
+    parser.add_argument('--status-file', help='write aggregated counters to this file as JSON')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    sys.path.insert(0, os.getcwd())
+    # The supervisor never imports the application itself, so that workers started on SIGHUP import it afresh
+    serve(args.application, args.port, args.address, args.processes or None,
+          drain_timeout=args.drain_timeout, report_interval=args.report_interval, status_file=args.status_file)
+
+
+if __name__ == '__main__':
+    main()
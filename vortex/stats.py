@@ -0,0 +1,169 @@
+import bisect
+import time
+
+from vortex import Resource
+from vortex.responses import HTTPOkResponse
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # seconds
+PHASES = ('traversal', 'handler', 'serialization', 'total')
+
+
+class Histogram(object):
+    # Fixed buckets, so observing never allocates and the IOLoop thread needs no locking
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], self.counts)),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class ResourceStats(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.latency = dict([(phase, Histogram(buckets)) for phase in PHASES])
+        self.statuses = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def compression_ratio(self):
+        return float(self.bytes_out) / self.bytes_in if self.bytes_in else None
+
+    def to_dict(self):
+        return {
+            'latency': dict([(phase, histogram.to_dict()) for phase, histogram in self.latency.iteritems()]),
+            'statuses': dict([(str(code), count) for code, count in self.statuses.iteritems()]),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'compression_ratio': self.compression_ratio,
+        }
+
+
+def _resource_name(resource):
+    if resource is None:
+        return 'NotFound'
+    if hasattr(resource, '__name__'):
+        return resource.__name__
+    return type(resource).__name__
+
+
+class RequestRecord(object):
+    def __init__(self, stats, method):
+        self.stats = stats
+        self.method = method
+        self.started = time.time()
+        self.resource = '<unresolved>'
+        self.traversal = None
+        self.handler = None
+        self.serialization = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._resolved_at = None
+
+    def resolved(self, resource):
+        self._resolved_at = time.time()
+        self.traversal = self._resolved_at - self.started
+        self.resource = _resource_name(resource)
+
+    def handled(self):
+        # Handlers that write their own stream serialize before returning, so that time is taken back out
+        if self.handler is None and self._resolved_at is not None:
+            self.handler = max(0.0, time.time() - self._resolved_at - self.serialization)
+
+    def finish(self, status_code):
+        self.handled()
+        self.stats.record(self, status_code, time.time() - self.started)
+
+
+class Stats(object):
+    METHODS = frozenset(('OPTIONS', 'GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'TRACE', 'PATCH'))
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.resources = {} # (resource name, method) -> ResourceStats
+
+    def start(self, request):
+        return RequestRecord(self, request.method if request.method in self.METHODS else 'OTHER')
+
+    def record(self, record, status_code, total):
+        key = (record.resource, record.method)
+        stats = self.resources.get(key)
+        if stats is None:
+            stats = self.resources[key] = ResourceStats(self.buckets)
+        if record.traversal is not None:
+            stats.latency['traversal'].observe(record.traversal)
+        if record.handler is not None:
+            stats.latency['handler'].observe(record.handler)
+        stats.latency['serialization'].observe(record.serialization)
+        stats.latency['total'].observe(total)
+        stats.statuses[status_code] = stats.statuses.get(status_code, 0) + 1
+        stats.bytes_in += record.bytes_in
+        stats.bytes_out += record.bytes_out
+
+    def to_dict(self):
+        return dict([('%s %s' % key, stats.to_dict()) for key, stats in self.resources.iteritems()])
+
+    def prometheus(self):
+        lines = [
+            '# TYPE vortex_request_duration_seconds histogram',
+        ]
+        for (name, method), stats in sorted(self.resources.iteritems()):
+            labels = 'resource="%s",method="%s"' % (_escape_label(name), method)
+            for phase in PHASES:
+                histogram = stats.latency[phase]
+                cumulative = 0
+                for bound, count in zip([repr(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('vortex_request_duration_seconds_bucket{%s,phase="%s",le="%s"} %d' % (labels, phase, bound, cumulative))
+                lines.append('vortex_request_duration_seconds_sum{%s,phase="%s"} %r' % (labels, phase, histogram.sum))
+                lines.append('vortex_request_duration_seconds_count{%s,phase="%s"} %d' % (labels, phase, histogram.count))
+        lines.append('# TYPE vortex_responses_total counter')
+        for (name, method), stats in sorted(self.resources.iteritems()):
+            for code, count in sorted(stats.statuses.iteritems()):
+                lines.append('vortex_responses_total{resource="%s",method="%s",code="%d"} %d' % (_escape_label(name), method, code, count))
+        lines.append('# TYPE vortex_body_bytes_total counter')
+        for (name, method), stats in sorted(self.resources.iteritems()):
+            labels = 'resource="%s",method="%s"' % (_escape_label(name), method)
+            lines.append('vortex_body_bytes_total{%s,stage="raw"} %d' % (labels, stats.bytes_in))
+            lines.append('vortex_body_bytes_total{%s,stage="encoded"} %d' % (labels, stats.bytes_out))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StatsResource(Resource):
+    def __init__(self, stats):
+        Resource.__init__(self)
+        self.stats = stats
+
+    def get(self, request, format='json'):
+        if format == 'prometheus':
+            return HTTPOkResponse(body=self.stats.prometheus(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+        return self.stats.to_dict()